@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """
-Аукцион-картины для Telegram (aiogram 3.x), один файл.
+Аукцион-картины для Telegram (aiogram 3.x). Правила игры без ввода-вывода лежат
+рядом в auction_rules.py — по ним же играет офлайн-симулятор simulate.py.
 
 Фишки:
 - Каждый игрок добавляет 2 картины: как фото ИЛИ через WebApp-рисовалку.
@@ -18,168 +19,1329 @@
 
 import asyncio
 import base64
+import collections
+import contextlib
+import contextvars
+import cProfile
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import itertools
 import json
 import logging
+import logging.handlers
+import math
+import queue
 import random
-from io import BytesIO
+import secrets
+import shutil
+import signal
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from io import BytesIO, StringIO
 from typing import Dict, Any, List
+from urllib.parse import urlsplit
 import os
+import pstats
+from aiohttp import ClientError, FormData
 from dotenv import load_dotenv
 
-from aiogram import Bot, Dispatcher, F, types
+try:
+    import brotli            # необязательно: br-сжатие статики рисовалки
+except ImportError:
+    brotli = None
+try:
+    import orjson            # необязательно: быстрый JSON для Bot API
+except ImportError:
+    orjson = None
+
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
     BufferedInputFile, WebAppInfo,
 )
+from aiogram.utils.web_app import safe_parse_webapp_init_data
+
+# правила игры без ввода-вывода — общие с симулятором simulate.py
+from auction_rules import (
+    BID_AUTHOR, BID_NO_MONEY, BID_OK, BID_STEPS, BID_TOO_LOW, LOAN_PAYBACK, LOAN_PLUS,
+    MAX_ARTS_PER_PLAYER, PASS_IGNORED, PASS_KEPT, PASS_SOLD,
+    Ledger, Lot, Player, deadline_outcome, open_lot, place_bid, place_pass, price_lot, round10,
+    take_loan,
+)
 
 load_dotenv()
 # ====== НАСТРОЙКИ ======
 API_TOKEN = os.getenv("API_TOKEN")
-START_MONEY = 3000
-LOAN_PLUS = 1000
-LOAN_PAYBACK = 1500
-
-MAX_ARTS_PER_PLAYER = 2
-
-# реальная стоимость лота
-REAL_MIN = 100
-REAL_MAX = 3500
-# стартовая цена должна быть ниже реальной
-START_OFFSETS = [100, 200, 300]  # насколько ниже реальной
+# экономика (деньги, кредит, цены лотов) — в auction_rules.py
 # таймер торгов (сек)
-BID_TIMER_SEC = 10
+BID_TIMER_SEC = int(os.getenv("BID_TIMER_SEC", "10"))
+# лимит длины одного сообщения Telegram
+TG_TEXT_LIMIT = 4096
+# на каких секундах обновлять таймер в подписи лота (вместо правки каждую секунду)
+COUNTDOWN_MARKS = (10, 5, 3, 1)
+# подпись лота после ставок обновляем не чаще, чем раз в это окно (сек)
+CAPTION_DEBOUNCE_SEC = 0.7
 
 # URL рисовалки (HTTPS). Пример: "https://<твой_ngrok>.ngrok.io/draw"
 DRAW_WEBAPP_URL = os.getenv("DRAW_WEBAPP_URL")  
+# страницу по нему отдаёт этот бот (ngrok на наш WEB_PORT): 1/0, по умолчанию — по хосту (см. draw_url)
+DRAW_SELF_HOSTED = {"1": True, "0": False}.get(os.getenv("DRAW_SELF_HOSTED", ""))
+# служебный чат/канал, куда грузим рисунки ради file_id (чтобы не мусорить в игре)
+STORAGE_CHAT_ID = int(os.getenv("STORAGE_CHAT_ID") or 0) or None
+UPLOAD_WORKERS = 4
+UPLOAD_QUEUE_MAX = 64        # больше — просим подождать
+FILE_ID_CACHE_MAX = 10000    # sha256 картинки -> file_id
+# прямая загрузка рисунка со страницы (POST /upload)
+UPLOAD_PATH = "/upload"
+UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+INIT_DATA_MAX_AGE = 24 * 60 * 60   # initData старше — не принимаем
+
+# ====== РЕЖИМ РАБОТЫ ======
+# polling (по умолчанию) или webhook на том же aiohttp-сервере, что отдаёт /draw
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8080"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")            # внешний https-адрес сервера, напр. ngrok
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# свой Bot API сервер (локальный telegram-bot-api или заглушка fake_botapi.py)
+BOT_API_URL = os.getenv("BOT_API_URL")
+# шардирование: SHARDS>1 — фронт + N процессов-воркеров (см. ШАРДИРОВАНИЕ ПО ПРОЦЕССАМ)
+SHARDS = max(1, int(os.getenv("SHARDS", "1")))
+SHARD_INDEX = int(os.environ["SHARD_INDEX"]) if os.getenv("SHARD_INDEX") else None
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT") or WEB_PORT + 1)   # воркер i слушает +i
+SHARD_PATH = "/shard/updates"
+SHARD_BATCH_MAX = 100
+SHARD_QUEUE_MAX = int(os.getenv("SHARD_QUEUE_MAX", "2000"))    # на воркер; больше — фронт не забирает у Telegram
+# приём апдейтов: в чате строго по очереди, между чатами параллельно (см. ПРИЁМ АПДЕЙТОВ)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "256"))       # одновременно в обработке
+UPDATE_QUEUE_MAX = int(os.getenv("UPDATE_QUEUE_MAX", "5000"))  # больше — не забираем у Telegram
+UPDATES_LIMIT = max(1, min(100, int(os.getenv("UPDATES_LIMIT", "100"))))  # getUpdates: за запрос
+UPDATES_TIMEOUT = int(os.getenv("UPDATES_TIMEOUT", "30"))      # getUpdates: long poll, секунд
 
 # ====== ЛОГИ ======
-logging.basicConfig(level=logging.INFO)
+# Цикл событий сам в stderr не пишет: QueueHandler кладёт запись в очередь, форматирует
+# и выводит её поток QueueListener. События партий — отдельно, см. ЖУРНАЛ СОБЫТИЙ.
+log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+_stderr = logging.StreamHandler()
+_stderr.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+log_listener = logging.handlers.QueueListener(log_queue, _stderr)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), handlers=[logging.handlers.QueueHandler(log_queue)])
+log_listener.start()
 log = logging.getLogger("auction")
 
-bot = Bot(API_TOKEN, parse_mode=None)
+# ====== СЕССИЯ BOT API ======
+# Свой connector (keep-alive, пул, DNS-кэш), быстрый JSON, если установлен orjson,
+# и «выстрелил и забыл» для горячих методов, чей ответ никто не читает: успешный
+# ответ не разбирается в pydantic-модель, ошибки — как обычно, через check_response.
+SESSION_POOL_LIMIT = int(os.getenv("SESSION_POOL_LIMIT", "100"))
+SESSION_KEEPALIVE_SEC = 75         # держим соединения дольше дефолтных 15 с
+PROXY_URL = os.getenv("PROXY_URL")  # например socks5://host:1080 (нужен aiohttp-socks)
+FIRE_AND_FORGET = frozenset({
+    "answerCallbackQuery", "editMessageText", "editMessageCaption",
+    "editMessageReplyMarkup", "deleteMessage",
+})
+
+if orjson is not None:
+    def json_dumps(value) -> str:
+        return orjson.dumps(value).decode()
+    json_loads = orjson.loads
+else:
+    json_dumps, json_loads = json.dumps, json.loads
+
+class AuctionSession(AiohttpSession):
+    """Сессия бота. Разметки из кэша клавиатур (см. cached_markup) уходят готовым JSON,
+    метод не прогоняется через model_dump целиком; ответы FIRE_AND_FORGET не валидируются."""
+
+    def __init__(self, **kwargs):
+        super().__init__(proxy=PROXY_URL, limit=SESSION_POOL_LIMIT,
+                         json_loads=json_loads, json_dumps=json_dumps, **kwargs)
+        self._connector_init.update(
+            limit_per_host=SESSION_POOL_LIMIT,
+            keepalive_timeout=SESSION_KEEPALIVE_SEC,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        )
+
+    async def make_request(self, bot: Bot, method, timeout: int | None = None):
+        name = method.__api_method__
+        if name not in FIRE_AND_FORGET:
+            return await super().make_request(bot, method, timeout)
+        session = await self.create_session()
+        url = self.api.api_url(token=bot.token, method=name)
+        try:
+            async with session.post(url, data=self.build_form_data(bot, method),
+                                    timeout=self.timeout if timeout is None else timeout) as resp:
+                raw = await resp.text()
+        except asyncio.TimeoutError as e:
+            raise TelegramNetworkError(method=method, message="Request timeout error") from e
+        except ClientError as e:
+            raise TelegramNetworkError(method=method, message=f"{type(e).__name__}: {e}") from e
+        if resp.status == 200:
+            data = self.json_loads(raw)
+            if data.get("ok"):
+                return data.get("result")   # True или «сырой» dict — результат не читается
+        return self.check_response(bot=bot, method=method, status_code=resp.status, content=raw).result
+
+    def build_form_data(self, bot: Bot, method) -> FormData:
+        form = FormData(quote_fields=False)
+        files: Dict[str, Any] = {}
+        for key, value in method:
+            value = markup_json.get(id(value)) or self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
+
+def make_session() -> AuctionSession:
+    if not BOT_API_URL:
+        return AuctionSession()
+    return AuctionSession(api=TelegramAPIServer.from_base(BOT_API_URL))
+
+
+bot = Bot(API_TOKEN, session=make_session(), parse_mode=None)
 dp = Dispatcher()
 
-# ====== СОСТОЯНИЕ ИГРЫ ======
-class Player:
-    def __init__(self, uid: int, name: str, username: str | None):
-        self.id = uid
+# ====== ТРАССИРОВКА ======
+# Каждый апдейт — трасса со спанами: ожидание в очереди чата (queue), разбор JSON в модели
+# (parse), фильтры (filters), обработчик (handler:on_bid), событие автомата партии
+# (game:bid), вызовы Bot API (api:answerCallbackQuery); таймер лота пишет свои трассы
+# (timer:tick, timer:deadline). Текущая трасса живёт в contextvar, а автомат партии,
+# outbox и ChatExecutor проносят её через свои очереди — так отложенный ответ на колбэк
+# и правка подписи попадают в трассу своей ставки. Последние TRACE_PER_CHAT трасс чата
+# лежат в кольцевом буфере: GET /debug/traces?chat=<id> (см. ОТЛАДКА).
+TRACE_ENABLED = os.getenv("TRACE", "1") != "0"
+TRACE_PER_CHAT = 64
+TRACE_CHATS_MAX = 2000
+
+class Trace:
+    __slots__ = ("chat_id", "kind", "update_id", "wall", "t0", "cursor", "spans")
+
+    def __init__(self, chat_id: int, kind: str, update_id: int | None, t0: float):
+        self.chat_id = chat_id
+        self.kind = kind
+        self.update_id = update_id
+        self.wall = time.time() - (time.perf_counter() - t0)
+        self.t0 = t0
+        self.cursor = t0             # конец последнего этапа апдейта (queue -> parse -> filters)
+        self.spans: list = []        # (имя, начало от t0, длительность), секунды
+
+    def span(self, name: str, start: float, end: float | None = None):
+        if end is None:
+            end = time.perf_counter()
+        self.spans.append((name, start - self.t0, end - start))
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "update_id": self.update_id,
+            "at": round(self.wall, 3),
+            "ms": round(max((s + d for _, s, d in self.spans), default=0.0) * 1000, 3),
+            "spans": [{"name": n, "start_ms": round(s * 1000, 3), "ms": round(d * 1000, 3)}
+                      for n, s, d in self.spans],
+        }
+
+current_trace: "contextvars.ContextVar[Trace | None]" = contextvars.ContextVar("current_trace", default=None)
+traces: "OrderedDict[int, deque]" = OrderedDict()   # chat_id -> последние трассы, по давности
+
+def begin_trace(chat_id: int, kind: str, update_id: int | None = None, t0: float | None = None) -> Trace | None:
+    if not TRACE_ENABLED:
+        return None
+    ring = traces.get(chat_id)
+    if ring is None:
+        ring = traces[chat_id] = deque(maxlen=TRACE_PER_CHAT)
+        if len(traces) > TRACE_CHATS_MAX:
+            traces.popitem(last=False)
+    else:
+        traces.move_to_end(chat_id)
+    tr = Trace(chat_id, kind, update_id, time.perf_counter() if t0 is None else t0)
+    ring.append(tr)   # сразу: поздние спаны (ответ из фона) допишутся в уже видимую трассу
+    return tr
+
+@contextlib.contextmanager
+def traced(chat_id: int, kind: str):
+    """Отдельная трасса (не апдейт) на время блока: таймер и т. п."""
+    tr = begin_trace(chat_id, kind)
+    token = current_trace.set(tr)
+    try:
+        yield tr
+    finally:
+        current_trace.reset(token)
+        if tr is not None:
+            tr.span(kind, tr.t0)
+
+def trace_span(name: str, start: float):
+    tr = current_trace.get()
+    if tr is not None:
+        tr.span(name, start)
+
+class UpdateTracing(BaseMiddleware):
+    """Внешний middleware апдейтов: от конца ожидания в очереди до начала диспетчеризации — разбор."""
+
+    async def __call__(self, handler, event, data):
+        tr = current_trace.get()
+        if tr is not None:
+            now = time.perf_counter()
+            tr.span("parse", tr.cursor, now)
+            tr.cursor = now
+        return await handler(event, data)
+
+# ====== МЕТРИКИ ======
+# Счётчики и гистограммы в текстовом формате Prometheus, отдаются на /metrics
+# того же aiohttp-сервера. Без внешних зависимостей: пара словарей на метрику.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DRIFT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram:
+    """Гистограмма с метками: на каждую метку — счётчики по корзинам, сумма и число."""
+    __slots__ = ("name", "help", "label", "buckets", "series")
+
+    def __init__(self, name: str, help: str, label: str | None = None, buckets=LATENCY_BUCKETS):
         self.name = name
-        self.username = username
-        self.money = START_MONEY
-        self.loan = False
-        self.arts_created = 0  # сколько картин добавил (макс 2)
-
-class Lot:
-    def __init__(self, lot_id: int, author_id: int, title: str, file_id: str, real_value: int, start_price: int):
-        self.id = lot_id
-        self.author_id = author_id
-        self.title = title
-        self.file_id = file_id
-        self.real_value = real_value
-        self.start_price = start_price
-        self.sold_to: int | None = None
-        self.sold_price: int = 0
-
-players: Dict[int, Player] = {}   # user_id -> Player
-lots: List[Lot] = []              # все лоты
-queue: List[int] = []             # очередь id лотов
-
-# текущее торги
-current: Dict[str, Any] = {
-    "chat_id": None,
-    "lot": None,           # Lot
-    "active_ids": [],      # кто может ставить (не автор)
-    "price": 0,
-    "leader": None,        # user_id
-    "passed": set(),       # user_id, пасанули в этом раунде
-    "photo_msg_id": None,  # id сообщения с фото лота
-    "timer_msg_id": None,  # id сообщения с таймером
-    "timer_task": None,    # asyncio.Task таймера
-    "auction_running": False,
-}
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.series: Dict[str, list] = {}   # метка -> [счётчики корзин..., сумма, число]
+
+    def observe(self, value: float, label: str = ""):
+        s = self.series.get(label)
+        if s is None:
+            s = self.series[label] = [0] * len(self.buckets) + [0.0, 0]
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                s[i] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    def render(self, out: List[str]):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} histogram")
+        for label, s in self.series.items():
+            lbl = f'{self.label}="{label}",' if self.label else ""
+            for b, n in zip(self.buckets, s):
+                out.append(f'{self.name}_bucket{{{lbl}le="{b}"}} {n}')
+            out.append(f'{self.name}_bucket{{{lbl}le="+Inf"}} {s[-1]}')
+            tail = f"{{{lbl.rstrip(',')}}}" if lbl else ""
+            out.append(f"{self.name}_sum{tail} {s[-2]:.6f}")
+            out.append(f"{self.name}_count{tail} {s[-1]}")
+
+class Counter:
+    __slots__ = ("name", "help", "label", "values")
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values: Dict[str, int] = {}
+
+    def inc(self, label: str = "", n: int = 1):
+        self.values[label] = self.values.get(label, 0) + n
+
+    def render(self, out: List[str]):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} counter")
+        for label, v in self.values.items():
+            lbl = f'{{{self.label}="{label}"}}' if self.label else ""
+            out.append(f"{self.name}{lbl} {v}")
+
+HANDLER_SECONDS = Histogram("auction_handler_seconds", "Время обработчика апдейта", "handler")
+HANDLER_ERRORS = Counter("auction_handler_errors_total", "Исключения в обработчиках", "handler")
+API_SECONDS = Histogram("auction_api_seconds", "Время вызова Bot API", "method")
+API_ERRORS = Counter("auction_api_errors_total", "Ошибки вызовов Bot API (кроме 429)", "method")
+API_RETRY_AFTER = Counter("auction_api_429_total", "Ответы 429 Too Many Requests", "method")
+TIMER_DRIFT = Histogram("auction_timer_drift_seconds",
+                        "Фактическое закрытие лота минус назначенный дедлайн", buckets=DRIFT_BUCKETS)
+EFFECT_ERRORS = Counter("auction_side_effect_errors_total", "Ошибки фоновых вызовов обработчиков", "effect")
+FLOOD_DROPPED = Counter("auction_flood_dropped_total", "Колбэки ставок, отбитые до обработчика", "reason")
+METRICS = (HANDLER_SECONDS, HANDLER_ERRORS, API_SECONDS, API_ERRORS, API_RETRY_AFTER, TIMER_DRIFT, EFFECT_ERRORS,
+           FLOOD_DROPPED)
+
+class HandlerMetrics(BaseMiddleware):
+    """Внутренний middleware наблюдателей: время и ошибки по имени обработчика."""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        t0 = time.perf_counter()
+        tr = current_trace.get()
+        if tr is not None:
+            tr.span("filters", tr.cursor, t0)
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - t0, name)
+            if tr is not None:
+                tr.span("handler:" + name, t0)
+
+class ApiMetrics(BaseRequestMiddleware):
+    """Middleware сессии бота: каждый вызов Bot API — время, ошибки и 429 по методу."""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            API_RETRY_AFTER.inc(name)
+            raise
+        except Exception:
+            API_ERRORS.inc(name)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - t0, name)
+            trace_span("api:" + name, t0)
+
+dp.update.outer_middleware(UpdateTracing())
+dp.message.middleware(HandlerMetrics())
+dp.callback_query.middleware(HandlerMetrics())
+bot.session.middleware(ApiMetrics())
+
+def render_metrics() -> str:
+    out: List[str] = []
+    for m in METRICS:
+        m.render(out)
+    bidding = sum(1 for g in games.values() if g.phase != PHASE_IDLE)
+    out += [
+        "# HELP auction_games Партии в реестре",
+        "# TYPE auction_games gauge",
+        f"auction_games {len(games)}",
+        "# HELP auction_games_bidding Партии с идущим лотом",
+        "# TYPE auction_games_bidding gauge",
+        f"auction_games_bidding {bidding}",
+        "# HELP auction_side_effects_pending Фоновые вызовы в очереди",
+        "# TYPE auction_side_effects_pending gauge",
+        f"auction_side_effects_pending {effects.pending}",
+        "# HELP auction_side_effects_dropped_total Отброшенные при переполнении",
+        "# TYPE auction_side_effects_dropped_total counter",
+        f"auction_side_effects_dropped_total {effects.dropped}",
+        "# HELP auction_updates_pending Апдейты в очередях чатов",
+        "# TYPE auction_updates_pending gauge",
+        f"auction_updates_pending {update_queue.pending}",
+        "# HELP auction_outbox_sent_total Успешно отправленные вызовы outbox",
+        "# TYPE auction_outbox_sent_total counter",
+        f"auction_outbox_sent_total {outbox.sent}",
+        "# HELP auction_outbox_coalesced_total Правки, схлопнутые более поздними",
+        "# TYPE auction_outbox_coalesced_total counter",
+        f"auction_outbox_coalesced_total {outbox.coalesced}",
+        "# HELP auction_outbox_retried_total Повторы после 429",
+        "# TYPE auction_outbox_retried_total counter",
+        f"auction_outbox_retried_total {outbox.retried}",
+    ]
+    return "\n".join(out) + "\n"
+
+# ====== СОСТОЯНИЕ ИГРЫ ======
+# Каждый чат — своя партия (Game). Партии живут в реестре games (chat_id -> Game),
+# простаивающие/завершённые выселяются по TTL, чтобы память не росла бесконечно.
+SESSION_TTL_SEC = 6 * 60 * 60      # сколько живёт партия без активности
+FINISHED_TTL_SEC = 30 * 60         # сколько держим партию после финала
+EVICT_EVERY_SEC = 60               # как часто чистим реестр
+
+# фазы торгов партии
+PHASE_IDLE = 0       # лота нет (сбор картин, пауза между лотами, финал)
+PHASE_OPENING = 1    # лот выбран, фото ещё отправляется
+PHASE_BIDDING = 2    # идут ставки
+
+class Game:
+    """Партия в одном чате: игроки, лоты, очередь и текущие торги."""
+    __slots__ = (
+        "chat_id", "players", "ledger", "events", "consumer", "phase",
+        "lot", "active_ids", "price", "leader", "passed",
+        "photo_msg_id", "deadline", "timer_gen", "shown_sec", "caption_handle", "prepared",
+        "auction_running", "start_handle", "finished", "dropped", "touched",
+    )
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.players: Dict[int, Player] = {}   # user_id -> Player
+        self.ledger = Ledger()                 # лоты, очередь, владения
+        self.events: asyncio.Queue = asyncio.Queue()   # события торгов (см. run_game)
+        self.consumer: asyncio.Task | None = None      # единственный их обработчик
+        self.phase = PHASE_IDLE
+        # текущие торги
+        self.lot: Lot | None = None
+        self.active_ids: List[int] = []        # кто может ставить (не автор)
+        self.price = 0
+        self.leader: int | None = None         # user_id
+        self.passed: set = set()               # user_id, пасанули в этом раунде
+        self.photo_msg_id: int | None = None   # id сообщения с фото лота (в подписи и таймер)
+        self.deadline: float | None = None     # monotonic-время закрытия лота
+        self.timer_gen = 0                     # поколение таймера (старые записи в куче игнорируются)
+        self.shown_sec: int | None = None      # сколько секунд сейчас написано в подписи лота
+        self.caption_handle: asyncio.TimerHandle | None = None  # отложенное обновление подписи
+        self.prepared: tuple | None = None     # (лот, подпись, клавиатура) следующего лота
+        self.auction_running = False
+        self.start_handle: asyncio.TimerHandle | None = None  # отложенный старт аукциона
+        self.finished = False                  # показали итоги
+        self.dropped = False                   # убрана из реестра — события больше не принимает
+        self.touched = time.monotonic()
+
+games: "OrderedDict[int, Game]" = OrderedDict()   # chat_id -> Game, по давности активности
+
+def get_game(chat_id: int) -> Game:
+    """O(1): найти (или создать) партию чата и отметить активность."""
+    g = games.get(chat_id)
+    if g is None:
+        g = Game(chat_id)
+        games[chat_id] = g
+    else:
+        games.move_to_end(chat_id)
+    g.touched = time.monotonic()
+    return g
+
+def drop_game(chat_id: int) -> Game | None:
+    """Убрать партию из реестра и остановить её таймер."""
+    g = games.pop(chat_id, None)
+    if g is not None:
+        g.dropped = True   # фото лота в полёте и отложенный старт не оживят её потребителя
+        journal.record("reset", chat_id)
+        event_log.emit("reset", chat_id)
+        scheduler.cancel(g)
+        if g.caption_handle is not None:
+            g.caption_handle.cancel()
+        if g.start_handle is not None:
+            g.start_handle.cancel()
+        outbox.forget(chat_id)
+        if g.consumer is not None:
+            g.consumer.cancel()
+    return g
+
+def evict_idle_games(now: float | None = None) -> int:
+    """Выселить партии, простоявшие дольше TTL. Реестр упорядочен по активности,
+    поэтому идём с самых старых и останавливаемся на первой живой."""
+    now = time.monotonic() if now is None else now
+    evicted = 0
+    for chat_id, g in list(games.items()):
+        idle = now - g.touched
+        if idle < FINISHED_TTL_SEC:
+            break
+        if g.finished or idle >= SESSION_TTL_SEC:
+            drop_game(chat_id)
+            evicted += 1
+    return evicted
+
+async def evictor_loop():
+    while True:
+        await asyncio.sleep(EVICT_EVERY_SEC)
+        n = evict_idle_games()
+        if n:
+            log.info("evicted %d idle games, active: %d", n, len(games))
+
+# ====== ТАЙМЕРЫ ЛОТОВ ======
+class DeadlineScheduler:
+    """Один планировщик на процесс: куча (время, seq, партия, поколение).
+
+    На каждый активный лот в куче живёт одна запись. Ставка лишь сдвигает
+    g.deadline и поднимает поколение — никаких cancel/create_task. Проснувшись,
+    планировщик либо закрывает лот, либо правит таймер в подписи лота на
+    ближайшей отметке из COUNTDOWN_MARKS и засыпает до следующей."""
+
+    def __init__(self):
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def _push(self, when: float, g: Game):
+        heapq.heappush(self._heap, (when, next(self._seq), g, g.timer_gen))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if self._heap[0][0] == when:
+            self._wake.set()
+
+    def start(self, g: Game, seconds: float | None = None):
+        """Запустить отсчёт для нового лота (таймер уже показывает seconds)."""
+        seconds = BID_TIMER_SEC if seconds is None else seconds
+        g.timer_gen += 1
+        g.deadline = time.monotonic() + seconds
+        g.shown_sec = math.ceil(seconds)
+        self._push(self._next_wake(g, seconds), g)
+
+    def extend(self, g: Game, seconds: float | None = None):
+        """Ставка: сдвинуть дедлайн. O(log n); новое время покажет отложенная подпись ставки."""
+        seconds = BID_TIMER_SEC if seconds is None else seconds
+        g.timer_gen += 1
+        g.deadline = time.monotonic() + seconds
+        self._push(self._next_wake(g, seconds), g)
+
+    def cancel(self, g: Game):
+        g.timer_gen += 1
+        g.deadline = None
+
+    @staticmethod
+    def _next_wake(g: Game, remaining: float) -> float:
+        mark = max((m for m in COUNTDOWN_MARKS if m < remaining - 1e-3), default=0)
+        return g.deadline - mark
+
+    async def _run(self):
+        heap = self._heap
+        while True:
+            if not heap:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            delay = heap[0][0] - time.monotonic()
+            if delay > 0:
+                self._wake.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                continue
+            _, _, g, gen = heapq.heappop(heap)
+            if gen != g.timer_gen or g.deadline is None:
+                continue  # лот закрыт или дедлайн сдвинут — запись устарела
+            self._fire(g)
+
+    def _fire(self, g: Game):
+        remaining = g.deadline - time.monotonic()
+        if remaining <= 0:
+            # решение принимает автомат партии; ставка, пришедшая раньше, сменит поколение
+            with traced(g.chat_id, "timer:deadline"):
+                post_event(g, EV_DEADLINE, g.timer_gen)
+            return
+        if math.ceil(remaining) != g.shown_sec:
+            with traced(g.chat_id, "timer:tick"):
+                refresh_lot_message(g, PRIO_TICK)
+            event_log.emit("tick", g.chat_id, l=g.lot.id, left=round(remaining, 3))
+        self._push(self._next_wake(g, remaining), g)
+
+scheduler = DeadlineScheduler()
+
+# ====== ОТПРАВКА В TELEGRAM ======
+# Все вызовы Bot API из игры идут через outbox: токен-бакеты на чат и на весь бот,
+# классы приоритета (продажа раньше тиков таймера), «последняя правка побеждает»
+# для одного (chat_id, message_id) и честное ожидание retry_after при 429.
+PRIO_SALE = 0      # продажа / итоги
+PRIO_LOT = 1       # новый лот, служебные сообщения, удаления
+PRIO_BID = 2       # подпись лота после ставки
+PRIO_TICK = 3      # тики таймера
+
+OUT_GLOBAL_RATE = float(os.getenv("OUT_GLOBAL_RATE", "30")) / SHARDS   # сообщений/сек на весь бот (делим между воркерами)
+OUT_GLOBAL_BURST = max(1, int(OUT_GLOBAL_RATE))
+OUT_CHAT_RATE = float(os.getenv("OUT_CHAT_RATE", "1"))   # сообщений/сек в один чат
+OUT_CHAT_BURST = int(os.getenv("OUT_CHAT_BURST", "4"))
+OUT_WORKERS = 8
+OUT_MAX_RETRIES = 3
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до свободного токена (0 — можно прямо сейчас)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class _Job:
+    __slots__ = ("prio", "seq", "chat_id", "key", "method", "kwargs", "futs", "dead", "tries", "trace")
+
+    def __init__(self, prio, seq, chat_id, key, method, kwargs):
+        self.prio = prio
+        self.seq = seq
+        self.chat_id = chat_id
+        self.key = key
+        self.method = method
+        self.kwargs = kwargs
+        self.futs: list = []
+        self.dead = False
+        self.tries = 0
+        self.trace = current_trace.get()   # чья это правка — для спана вызова
+
+class _Lane:
+    """Очередь одного чата: куча заданий + свой бакет. В работе — не больше одного
+    задания чата за раз, так что порядок внутри приоритета сохраняется."""
+    __slots__ = ("jobs", "bucket", "busy", "blocked_until")
+
+    def __init__(self):
+        self.jobs: list = []
+        self.bucket = TokenBucket(OUT_CHAT_RATE, OUT_CHAT_BURST)
+        self.busy = False
+        self.blocked_until = 0.0
+
+class Outbox:
+    def __init__(self, bot: Bot, workers: int = OUT_WORKERS):
+        self.bot = bot
+        self.workers = workers
+        self.bucket = TokenBucket(OUT_GLOBAL_RATE, OUT_GLOBAL_BURST)
+        self._lanes: Dict[int, _Lane] = {}
+        self._pending: Dict[Any, _Job] = {}  # ключ коалесцирования -> ожидающее задание
+        self._ready: list = []               # (prio, seq, chat_id)
+        self._delayed: list = []             # (когда, seq, chat_id)
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    # --- постановка ---
+    def _submit(self, chat_id: int, method: str, prio: int, key, kwargs) -> _Job:
+        old = self._pending.get(key) if key is not None else None
+        if old is not None:
+            # ещё не ушло: старая правка больше не нужна
+            old.dead = True
+            prio = min(prio, old.prio)
+            self.coalesced += 1
+        job = _Job(prio, next(self._seq), chat_id, key, method, kwargs)
+        if old is not None:
+            job.futs = old.futs
+        if key is not None:
+            self._pending[key] = job
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _Lane()
+        heapq.heappush(lane.jobs, (job.prio, job.seq, job))
+        if not lane.busy:
+            heapq.heappush(self._ready, (job.prio, job.seq, chat_id))
+        self._ensure_workers()
+        self._wake.set()
+        return job
+
+    def post(self, chat_id: int, method: str, /, prio: int = PRIO_LOT, key=None, **kwargs):
+        """Отправить и забыть (ошибки пишутся в лог)."""
+        self._submit(chat_id, method, prio, key, kwargs)
+
+    async def call(self, chat_id: int, method: str, /, prio: int = PRIO_LOT, key=None, **kwargs):
+        """Отправить и дождаться результата (например, message_id)."""
+        fut = asyncio.get_running_loop().create_future()
+        self._submit(chat_id, method, prio, key, kwargs).futs.append(fut)
+        return await fut
+
+    def _ensure_workers(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    # --- выборка ---
+    def _pick(self, now: float):
+        """Следующий чат, которому можно слать, и его задание; иначе (None, сколько ждать)."""
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._delayed)
+            lane = self._lanes.get(chat_id)
+            if lane is not None and not lane.busy:
+                if lane.jobs:
+                    top = lane.jobs[0]
+                    heapq.heappush(self._ready, (top[0], top[1], chat_id))
+                else:
+                    self._retire(chat_id, lane, now)
+        while self._ready:
+            _, _, chat_id = heapq.heappop(self._ready)
+            lane = self._lanes.get(chat_id)
+            if lane is None or lane.busy:
+                continue
+            while lane.jobs and lane.jobs[0][2].dead:
+                heapq.heappop(lane.jobs)
+            if not lane.jobs:
+                self._retire(chat_id, lane, now)
+                continue
+            wait = max(lane.blocked_until - now, lane.bucket.delay(now))
+            if wait > 0:
+                heapq.heappush(self._delayed, (now + wait, next(self._seq), chat_id))
+                continue
+            return lane, heapq.heappop(lane.jobs)[2], 0.0
+        wait = self._delayed[0][0] - now if self._delayed else None
+        return None, None, wait
+
+    async def _worker(self):
+        while True:
+            now = time.monotonic()
+            lane, job, wait = self._pick(now)
+            if job is None:
+                self._wake.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                continue
+            lane.busy = True
+            try:
+                gwait = self.bucket.delay(now)
+                if gwait > 0:
+                    await asyncio.sleep(gwait)
+                    self.bucket.delay(time.monotonic())
+                self.bucket.take()
+                lane.bucket.take()
+                await self._run(lane, job)
+            finally:
+                lane.busy = False
+                if lane.jobs:
+                    top = lane.jobs[0]
+                    heapq.heappush(self._ready, (top[0], top[1], job.chat_id))
+                    self._wake.set()
+                else:
+                    self._retire(job.chat_id, lane, time.monotonic())
+
+    def _retire(self, chat_id: int, lane: _Lane, now: float):
+        """Убрать опустевшую очередь чата. Новый _Lane забыл бы лимит чата и retry_after,
+        поэтому убираем, когда бакет снова полон и 429 истёк, а до тех пор — запись в _delayed."""
+        if lane.busy or lane.jobs or self._lanes.get(chat_id) is not lane:
+            return
+        b = lane.bucket
+        b.delay(now)
+        when = max(lane.blocked_until, now + (b.capacity - b.tokens) / b.rate)
+        if when <= now + 0.001:
+            del self._lanes[chat_id]
+        else:
+            heapq.heappush(self._delayed, (when, next(self._seq), chat_id))
+            self._wake.set()
+
+    def forget(self, chat_id: int):
+        """Партию чата сбросили: пустая очередь чата уйдёт, как только это безопасно."""
+        lane = self._lanes.get(chat_id)
+        if lane is not None:
+            self._retire(chat_id, lane, time.monotonic())
+
+    async def _run(self, lane: _Lane, job: _Job):
+        if job.dead:
+            return
+        if job.key is not None and self._pending.get(job.key) is job:
+            del self._pending[job.key]
+        token = current_trace.set(job.trace)
+        try:
+            result = await getattr(self.bot, job.method)(**job.kwargs)
+        except TelegramRetryAfter as e:
+            lane.blocked_until = time.monotonic() + e.retry_after
+            log.warning("429 on %s in chat %s, retry after %ss", job.method, job.chat_id, e.retry_after)
+            job.tries += 1
+            newer = job.key is not None and job.key in self._pending
+            if job.tries <= OUT_MAX_RETRIES and not newer:
+                self.retried += 1
+                if job.key is not None:
+                    self._pending[job.key] = job
+                heapq.heappush(lane.jobs, (job.prio, job.seq, job))
+                return
+            self._resolve(job, exc=e)
+            return
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e):
+                log.info("%s failed in chat %s: %s", job.method, job.chat_id, e)
+            self._resolve(job, exc=e)
+            return
+        except Exception as e:
+            log.warning("%s failed in chat %s: %r", job.method, job.chat_id, e)
+            self._resolve(job, exc=e)
+            return
+        finally:
+            current_trace.reset(token)
+        self.sent += 1
+        self._resolve(job, result=result)
+
+    @staticmethod
+    def _resolve(job: _Job, result=None, exc: BaseException | None = None):
+        for fut in job.futs:
+            if fut.done():
+                continue
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(result)
+
+outbox = Outbox(bot)
+
+# ====== ЖУРНАЛ И ВОССТАНОВЛЕНИЕ ======
+# Каждый переход состояния (вход, кредит, лот, старт, открытие лота, ставка, пасс,
+# продажа, финал, сброс) пишется строкой JSON в журнал. Писатель — отдельный поток,
+# пишет пачками, так что цикл событий на диск не ждёт. Периодически снимаем снапшот
+# всех партий и начинаем журнал заново. При старте: снапшот + хвост журнала.
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "data")
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "1") != "0"
+SNAPSHOT_EVERY_SEC = 60
+
+class Journal:
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, "journal.jsonl")
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.directory = directory
+        self._q: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self.since_snapshot = 0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._writer, name="journal", daemon=True)
+        self._thread.start()
+
+    def record(self, kind: str, chat_id: int, **fields):
+        """Поставить событие в очередь на запись (без ожидания диска)."""
+        if self._thread is None:
+            return
+        fields["e"] = kind
+        fields["c"] = chat_id
+        self._q.put(fields)
+        self.since_snapshot += 1
+
+    def snapshot(self, state: list):
+        """Снапшот уходит в тот же поток: всё, что было до него, остаётся в старом журнале."""
+        if self._thread is None:
+            return
+        self._q.put(("snapshot", state))
+        self.since_snapshot = 0
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._q.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _writer(self):
+        f = open(self.path, "a", encoding="utf-8")
+        try:
+            while True:
+                batch = [self._q.get()]
+                with contextlib.suppress(queue.Empty):
+                    while len(batch) < 1024:
+                        batch.append(self._q.get_nowait())
+                lines = []
+                stop = False
+                for item in batch:
+                    if item is None:
+                        stop = True
+                        break
+                    if isinstance(item, tuple):
+                        # сначала дописываем накопленное, потом снапшот и пустой журнал
+                        self._write(f, lines)
+                        lines = []
+                        f.close()
+                        self._write_snapshot(item[1])
+                        f = open(self.path, "w", encoding="utf-8")
+                        continue
+                    lines.append(json.dumps(item, ensure_ascii=False, separators=(",", ":")))
+                self._write(f, lines)
+                if stop:
+                    return
+        finally:
+            f.close()
+
+    @staticmethod
+    def _write(f, lines: List[str]):
+        if not lines:
+            return
+        f.write("\n".join(lines) + "\n")
+        f.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(f.fileno())
+
+    def _write_snapshot(self, state: list):
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as sf:
+            json.dump(state, sf, ensure_ascii=False, separators=(",", ":"))
+            sf.flush()
+            os.fsync(sf.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+    def load(self):
+        """(снапшот, события журнала) с диска; битую последнюю строку пропускаем."""
+        state = []
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as sf:
+                state = json.load(sf)
+        events = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        log.warning("journal: skipped broken line")
+        return state, events
+
+journal = Journal(JOURNAL_DIR)
+
+# ====== ЖУРНАЛ СОБЫТИЙ ======
+# Для разбора споров и аналитики: вход, кредит, лот, старт, открытие лота, ставка (и отказ
+# с причиной), пасс, продажа, итоги, сброс — строкой JSON с короткими ключами: e — событие,
+# c — чат, l — лот, u — игрок, p — цена, t — время, left — сколько оставалось на таймере.
+# В отличие от журнала восстановления снапшот его не обнуляет: файл ротируется по размеру,
+# старые куски сжимаются gzip. Цикл событий только кладёт запись в очередь QueueHandler,
+# в файл пишет поток QueueListener. Частые события прореживаются EVENT_SAMPLE
+# ("tick=0.1" — писать десятую часть); для восстановления партии нужны все, кроме tick.
+# Разбор и проверка партии по журналу: python auction_log.py <чат>.
+EVENT_LOG = os.getenv("EVENT_LOG", os.path.join(JOURNAL_DIR, "events.jsonl"))   # "" — выключить
+EVENT_LOG_MAX_BYTES = int(os.getenv("EVENT_LOG_MAX_BYTES", str(32 * 1024 * 1024)))
+EVENT_LOG_BACKUPS = int(os.getenv("EVENT_LOG_BACKUPS", "20"))
+EVENT_SAMPLE = {k: float(v) for k, v in
+                (item.split("=") for item in os.getenv("EVENT_SAMPLE", "tick=0.1").split(",") if item)}
+
+class EventFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.ev, ensure_ascii=False, separators=(",", ":"))
+
+class EventQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record   # поля события уже готовы — не форматируем в цикле событий
+
+def gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+class EventLog:
+    def __init__(self, path: str):
+        self.path = path
+        self.logger = logging.getLogger("auction.events")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self._listener: logging.handlers.QueueListener | None = None
+
+    def start(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fh = logging.handlers.RotatingFileHandler(self.path, maxBytes=EVENT_LOG_MAX_BYTES,
+                                                  backupCount=EVENT_LOG_BACKUPS, encoding="utf-8")
+        fh.setFormatter(EventFormatter())
+        fh.namer = lambda name: name + ".gz"
+        fh.rotator = gzip_rotator
+        q: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.logger.addHandler(EventQueueHandler(q))
+        self._listener = logging.handlers.QueueListener(q, fh)
+        self._listener.start()
+
+    def emit(self, kind: str, chat_id: int, **fields):
+        """Событие партии в очередь журнала (без ожидания диска); прореживание по EVENT_SAMPLE."""
+        if self._listener is None:
+            return
+        rate = EVENT_SAMPLE.get(kind)
+        if rate is not None and random.random() >= rate:
+            return
+        fields["e"] = kind
+        fields["c"] = chat_id
+        fields["t"] = round(time.time(), 3)
+        self.logger.info(kind, extra={"ev": fields})
+
+    def close(self):
+        if self._listener is None:
+            return
+        self._listener.stop()
+        for h in self._listener.handlers:
+            h.close()
+        self.logger.handlers.clear()
+        self._listener = None
+
+event_log = EventLog(EVENT_LOG)
+
+def time_left(g: Game) -> float | None:
+    return round(g.deadline - time.monotonic(), 3) if g.deadline is not None else None
+
+def game_to_dict(g: Game) -> dict:
+    cur = None
+    queue = list(g.ledger.queue)
+    if g.lot is not None and g.phase == PHASE_OPENING:
+        # фото лота ещё не ушло — ни сообщения, ни дедлайна: после рестарта откроем его заново
+        queue.insert(0, g.lot.id)
+    elif g.lot is not None:
+        cur = {
+            "lot": g.lot.id, "active": g.active_ids, "price": g.price, "leader": g.leader,
+            "passed": list(g.passed), "photo": g.photo_msg_id,
+            "until": time.time() + (g.deadline - time.monotonic()) if g.deadline else None,
+        }
+    return {
+        "c": g.chat_id,
+        "players": [[p.id, p.name, p.username, p.money, p.loan, p.arts_created] for p in g.players.values()],
+        "lots": [[l.id, l.author_id, l.title, l.file_id, l.real_value, l.start_price, l.sold_to, l.sold_price]
+                 for l in g.ledger.lots],
+        # в паузе перед стартом (start_handle) очередь ещё не собрана — это не «между лотами»
+        "queue": queue, "running": g.auction_running and g.start_handle is None, "finished": g.finished, "cur": cur,
+    }
+
+def game_from_dict(d: dict) -> tuple:
+    """(Game, wall-clock дедлайн текущего лота или None)."""
+    g = Game(d["c"])
+    for pid, name, username, money, loan, arts in d["players"]:
+        p = Player(pid, name, username)
+        p.money, p.loan, p.arts_created = money, loan, arts
+        g.players[pid] = p
+    for lid, author, title, file_id, real, start, sold_to, sold_price in d["lots"]:
+        lot = Lot(lid, author, title, file_id, real, start)
+        g.ledger.add(lot)
+        if sold_to is not None:
+            g.ledger.settle(lot, None, sold_to, sold_price)
+    g.ledger.queue = deque(d["queue"])
+    g.auction_running, g.finished = d["running"], d["finished"]
+    cur = d.get("cur")
+    if cur:
+        g.lot = g.ledger.by_id[cur["lot"]]
+        g.active_ids, g.price, g.leader = cur["active"], cur["price"], cur["leader"]
+        g.passed = set(cur["passed"])
+        g.photo_msg_id = cur["photo"]
+        return g, cur["until"]
+    return g, None
+
+def replay_event(ev: dict, restored: Dict[int, Game], until: Dict[int, float]):
+    """Применить одно событие журнала к восстанавливаемым партиям."""
+    kind, chat_id = ev["e"], ev["c"]
+    if kind == "reset":
+        restored.pop(chat_id, None)
+        until.pop(chat_id, None)
+        return
+    g = restored.get(chat_id)
+    if g is None:
+        g = restored[chat_id] = Game(chat_id)
+    if kind == "join":
+        if ev["uid"] not in g.players:
+            g.players[ev["uid"]] = Player(ev["uid"], ev["name"], ev.get("username"))
+    elif kind == "loan":
+        take_loan(g.players[ev["uid"]])
+    elif kind == "lot":
+        g.ledger.add(Lot(ev["id"], ev["author"], ev["title"], ev["file_id"], ev["real"], ev["start"]))
+        g.players[ev["author"]].arts_created += 1
+    elif kind == "start":
+        g.auction_running = True
+        g.ledger.queue = deque(ev["queue"])
+    elif kind == "open":
+        if g.ledger.queue and g.ledger.queue[0] == ev["id"]:
+            g.ledger.queue.popleft()
+        g.lot = g.ledger.by_id[ev["id"]]
+        g.active_ids, g.price, g.leader = ev["active"], ev["price"], None
+        g.passed = set()
+        g.photo_msg_id = ev["photo"]
+        until[chat_id] = ev["until"]
+    elif kind == "bid":
+        g.price, g.leader = ev["price"], ev["uid"]
+        g.passed.clear()
+        until[chat_id] = ev["until"]
+    elif kind == "pass":
+        g.passed.add(ev["uid"])
+    elif kind == "sale":
+        lot = g.ledger.by_id[ev["id"]]
+        # лот без покупателей и лот, чьё фото не ушло, закрываются без "open" — и стоят в очереди
+        if g.ledger.queue and g.ledger.queue[0] == lot.id:
+            g.ledger.queue.popleft()
+        elif lot.id in g.ledger.queue:
+            g.ledger.queue.remove(lot.id)
+        owner = g.players.get(ev["owner"]) if ev["price"] else None
+        g.ledger.settle(lot, owner, ev["owner"], ev["price"])
+        if g.lot is lot:
+            g.lot, g.leader, g.active_ids = None, None, []
+            g.passed = set()
+            until.pop(chat_id, None)
+    elif kind == "finish":
+        g.auction_running = False
+        g.finished = True
+
+def restore_games() -> int:
+    """Поднять партии из снапшота и журнала, перезапустить идущие торги."""
+    state, events = journal.load()
+    restored: Dict[int, Game] = {}
+    until: Dict[int, float] = {}
+    for d in state:
+        g, wall = game_from_dict(d)
+        restored[g.chat_id] = g
+        if wall is not None:
+            until[g.chat_id] = wall
+    for ev in events:
+        replay_event(ev, restored, until)
+    for chat_id, g in restored.items():
+        games[chat_id] = g
+        if g.lot is not None:
+            # лот шёл — досчитываем оставшееся время (если уже вышло — закрываем сразу)
+            g.phase = PHASE_BIDDING
+            remaining = until.get(chat_id, time.time()) - time.time()
+            scheduler.start(g, max(remaining, 0.05))
+        elif g.auction_running:
+            # упали между лотами — продолжаем со следующего
+            post_event(g, EV_NEXT)
+        elif not g.finished and everyone_ready(g):
+            # упали в паузе перед стартом: картины все, записи "start" нет — стартуем сами,
+            # новых картин, которые запустили бы аукцион, уже не будет
+            g.auction_running = True
+            post_event(g, EV_START)
+    return len(restored)
+
+def snapshot_games():
+    journal.snapshot([game_to_dict(g) for g in games.values()])
+
+async def snapshot_loop():
+    while True:
+        await asyncio.sleep(SNAPSHOT_EVERY_SEC)
+        if journal.since_snapshot:
+            snapshot_games()
+
+def settle_lot(g: Game, lot: Lot, owner_id: int, price: int = 0):
+    """Записать итог лота в учёт и журнал (price=0 — лот остался у автора)."""
+    g.ledger.settle(lot, g.players[owner_id] if price else None, owner_id, price)
+    journal.record("sale", g.chat_id, id=lot.id, owner=owner_id, price=price)
+    event_log.emit("sale", g.chat_id, l=lot.id, u=owner_id, p=price, real=lot.real_value,
+                   left=time_left(g) if price else None)
 
 # ====== УТИЛИТЫ ======
-def round10(x: int) -> int:
-    """Округление вниз до десятки: 234 -> 230."""
-    return (x // 10) * 10
-
-def make_bid_keyboard(price: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text=f"+100 → {price+100}", callback_data=f"bid:{price+100}"),
-            InlineKeyboardButton(text=f"+200 → {price+200}", callback_data=f"bid:{price+200}"),
-            InlineKeyboardButton(text=f"+300 → {price+300}", callback_data=f"bid:{price+300}"),
-        ],
-        [InlineKeyboardButton(text="🚫 Пасс", callback_data="pass")]
-    ])
-
-def restart_kb() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="🔄 Рестарт игры")]],
+# Клавиатуры зависят от немногого (цена, раскладка шагов, язык), поэтому каждая
+# собирается один раз: LRU готовых разметок плюс их JSON, который AuctionSession
+# подставляет в запрос вместо повторной сериализации. Разметки общие — не менять!
+LOCALE = "ru"
+KB_TEXTS = {
+    "ru": {"bid": "+{step} → {price}", "pass": "🚫 Пасс",
+           "restart": "🔄 Рестарт игры", "draw": "🖌️ Нарисовать картину"},
+}
+KEYBOARD_CACHE_MAX = 4096
+keyboards: "OrderedDict[tuple, Any]" = OrderedDict()   # ключ -> разметка
+markup_json: Dict[int, str] = {}                       # id(разметки) -> её JSON
+
+def cached_markup(key: tuple, build):
+    kb = keyboards.get(key)
+    if kb is not None:
+        keyboards.move_to_end(key)
+        return kb
+    kb = keyboards[key] = build()
+    markup_json[id(kb)] = json_dumps(kb.model_dump(exclude_none=True))
+    if len(keyboards) > KEYBOARD_CACHE_MAX:
+        _, old = keyboards.popitem(last=False)
+        markup_json.pop(id(old), None)
+    return kb
+
+def make_bid_keyboard(price: int, steps: tuple = BID_STEPS, locale: str = LOCALE) -> InlineKeyboardMarkup:
+    def build():
+        t = KB_TEXTS[locale]
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=t["bid"].format(step=step, price=price + step),
+                                  callback_data=f"bid:{price + step}") for step in steps],
+            [InlineKeyboardButton(text=t["pass"], callback_data="pass")]
+        ])
+    return cached_markup(("bid", price, steps, locale), build)
+
+def restart_kb(locale: str = LOCALE) -> ReplyKeyboardMarkup:
+    return cached_markup(("restart", locale), lambda: ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=KB_TEXTS[locale]["restart"])]],
         resize_keyboard=True
-    )
+    ))
 
-def draw_kb() -> ReplyKeyboardMarkup:
+def draw_kb(chat_id: int | None = None, locale: str = LOCALE) -> ReplyKeyboardMarkup:
+    # своя на каждый чат (подписанная ссылка) и нужна раз на /start — в LRU не кладём,
+    # иначе тысячи чатов вытеснили бы оттуда горячие клавиатуры ставок
     return ReplyKeyboardMarkup(
         keyboard=[[
-            KeyboardButton(text="🖌️ Нарисовать картину", web_app=WebAppInfo(url=DRAW_WEBAPP_URL))
+            KeyboardButton(text=KB_TEXTS[locale]["draw"], web_app=WebAppInfo(url=draw_url(chat_id)))
         ]],
         resize_keyboard=True
     )
 
-def ensure_player(u: types.User) -> Player:
-    p = players.get(u.id)
+# Шаблоны подписей и строк итогов — в одном месте. Это f-строки: CPython компилирует
+# их в байткод при импорте, и они быстрее str.format/Template (см. bench.py).
+def lot_open_caption(lot_id: int, price: int, sec: int) -> str:
+    return f"🎨 ЛОТ №{lot_id}\n💰 Стартовая цена: {price}\nНажимайте на ставки или «Пасс».\n⏳ Осталось: {sec} сек."
+
+def lot_bid_caption(lot_id: int, price: int, leader: str, sec: int) -> str:
+    return f"🎨 ЛОТ №{lot_id}\n📈 Текущая ставка: {price} (от {leader})\n⏳ Осталось: {sec} сек."
+
+def lot_sold_caption(reason: str, lot_id: int, buyer: str, price: int) -> str:
+    return (f"✅ {reason} — ЛОТ №{lot_id} продан {buyer} за {price} 💰\n"
+            f"💎 Реальная стоимость будет раскрыта в финале.")
+
+def lot_kept_caption(lot_id: int, text: str) -> str:
+    return f"🎨 ЛОТ №{lot_id}\n{text}"
+
+def result_lot_line(l: Lot, author: str, buyer: str | None) -> str:
+    if buyer is None:
+        return (f"🎨 Лот №{l.id} — «{l.title}» (автор: {author})\n"
+                f"   ❌ Не продан | 💎 Реальная стоимость: {l.real_value}\n")
+    return (f"🎨 Лот №{l.id} — «{l.title}» (автор: {author})\n"
+            f"   🏷 Продан {buyer} за {l.sold_price} 💰 | 💎 Реальная стоимость: {l.real_value}\n")
+
+def result_rank_line(n: int, p: Player, cap: int, value_sum: int) -> str:
+    return (f"{n}. {p.name} — капитал: {cap} 💰 (баланс: {p.money}, картины: {value_sum}, "
+            f"кредит: {'да' if p.loan else 'нет'})")
+
+def ensure_player(g: Game, u: types.User) -> Player:
+    p = g.players.get(u.id)
     if not p:
         p = Player(u.id, u.first_name or str(u.id), u.username)
-        players[u.id] = p
+        g.players[u.id] = p
+        journal.record("join", g.chat_id, uid=p.id, name=p.name, username=p.username)
+        event_log.emit("join", g.chat_id, u=p.id, name=p.name)
     return p
 
-def everyone_ready() -> bool:
-    if not players:
+def everyone_ready(g: Game) -> bool:
+    if not g.players:
         return False
-    return all(p.arts_created >= MAX_ARTS_PER_PLAYER for p in players.values())
-
-def compute_capital(p: Player) -> int:
-    value_sum = sum(l.real_value for l in lots if l.sold_to == p.id)
-    cap = p.money + value_sum
-    if p.loan:
-        cap -= LOAN_PAYBACK
-    return cap
+    return all(p.arts_created >= MAX_ARTS_PER_PLAYER for p in g.players.values())
+
+def compute_capital(g: Game, p: Player) -> int:
+    return g.ledger.capital(p)
+
+def paginate(lines: List[str], limit: int = TG_TEXT_LIMIT) -> List[str]:
+    """Склеить строки в сообщения не длиннее limit (длинную строку режем)."""
+    pages, buf, size = [], [], 0
+    for line in lines:
+        while len(line) > limit:
+            if buf:
+                pages.append("\n".join(buf))
+                buf, size = [], 0
+            pages.append(line[:limit])
+            line = line[limit:]
+        extra = len(line) + (1 if buf else 0)
+        if size + extra > limit:
+            pages.append("\n".join(buf))
+            buf, size, extra = [], 0, len(line)
+        buf.append(line)
+        size += extra
+    if buf:
+        pages.append("\n".join(buf))
+    return pages
 
 # ====== КОМАНДЫ ======
+def reply(m: types.Message, text: str, **kwargs):
+    """Ответ в чат сообщения через outbox: лимиты чата и бота, ретраи на RetryAfter."""
+    if m.is_topic_message:
+        kwargs["message_thread_id"] = m.message_thread_id
+    outbox.post(m.chat.id, "send_message", PRIO_LOT, chat_id=m.chat.id, text=text, **kwargs)
+
 @dp.message(Command("start"))
 async def cmd_start(m: types.Message):
-    ensure_player(m.from_user)
-    await m.answer(
+    ensure_player(get_game(m.chat.id), m.from_user)
+    reply(m,
         "🎨 Привет! Это аукцион картин.\n"
         "1) Вступай: /join\n"
         "2) Добавь 2 картины — пришли фото ИЛИ жми «🖌️ Нарисовать картину» ниже.\n"
         "Когда все добавят по 2 — аукцион стартует автоматически.",
-        reply_markup=draw_kb()
+        reply_markup=draw_kb(m.chat.id)
     )
 
 @dp.message(Command("join"))
 async def cmd_join(m: types.Message):
-    p = ensure_player(m.from_user)
-    await m.answer(f"👤 {p.name} в игре! Баланс: {p.money} 💰")
+    p = ensure_player(get_game(m.chat.id), m.from_user)
+    reply(m, f"👤 {p.name} в игре! Баланс: {p.money} 💰")
 
 @dp.message(Command("loan"))
 async def cmd_loan(m: types.Message):
-    p = ensure_player(m.from_user)
-    if p.loan:
-        await m.answer("🏦 Ты уже брал кредит.")
+    g = get_game(m.chat.id)
+    p = ensure_player(g, m.from_user)
+    if not take_loan(p):
+        reply(m, "🏦 Ты уже брал кредит.")
         return
-    p.loan = True
-    p.money += LOAN_PLUS
-    await m.answer(f"🏦 Кредит +{LOAN_PLUS}. В конце спишется {LOAN_PAYBACK}.")
+    journal.record("loan", g.chat_id, uid=p.id)
+    event_log.emit("loan", g.chat_id, u=p.id)
+    reply(m, f"🏦 Кредит +{LOAN_PLUS}. В конце спишется {LOAN_PAYBACK}.")
 
 @dp.message(Command("status"))
 async def cmd_status(m: types.Message):
-    p = ensure_player(m.from_user)
-    own = [l.id for l in lots if l.sold_to == p.id]
-    await m.answer(
+    g = get_game(m.chat.id)
+    p = ensure_player(g, m.from_user)
+    own = g.ledger.owned(p.id)
+    reply(m,
         f"👤 {p.name}\nБаланс: {p.money} 💰\nКредит: {'да' if p.loan else 'нет'}\n"
         f"Добавлено картин: {p.arts_created}/{MAX_ARTS_PER_PLAYER}\nКуплено: {own}"
     )
@@ -193,20 +1355,10 @@ async def cmd_restart(m: types.Message):
     await restart_game(m.chat.id)
 
 async def restart_game(chat_id: int):
-    # отменяем таймер, если шёл
-    t = current.get("timer_task")
-    if t and not t.done():
-        t.cancel()
-        with contextlib.suppress(Exception):
-            await t
-    # чистим всё
-    players.clear()
-    lots.clear()
-    queue.clear()
-    for k in list(current.keys()):
-        current[k] = None
-    current.update({"auction_running": False})
-    await bot.send_message(chat_id, "♻️ Игра сброшена. /join чтобы начать заново.", reply_markup=ReplyKeyboardRemove())
+    # сбрасываем только партию этого чата: таймер стоп, сессию из реестра вон
+    drop_game(chat_id)
+    outbox.post(chat_id, "send_message", PRIO_SALE, chat_id=chat_id,
+                text="♻️ Игра сброшена. /join чтобы начать заново.", reply_markup=ReplyKeyboardRemove())
 # Команда /draw
 @dp.message(Command("draw"))
 async def draw_cmd(message: types.Message):
@@ -218,343 +1370,847 @@ async def draw_cmd(message: types.Message):
             )]
         ]
     )
-    await message.answer("Нажми кнопку ниже, чтобы начать рисовать:", reply_markup=keyboard)
+    reply(message, "Нажми кнопку ниже, чтобы начать рисовать:", reply_markup=keyboard)
 
 # ====== ПРИЁМ ФОТО КАРТИН ======
 @dp.message(F.photo)
 async def on_photo(m: types.Message):
-    p = ensure_player(m.from_user)
-    if p.arts_created >= MAX_ARTS_PER_PLAYER:
-        await m.answer("⚠️ У тебя уже 2 картины.")
+    g = get_game(m.chat.id)
+    p = ensure_player(g, m.from_user)
+    if p.arts_created + p.arts_pending >= MAX_ARTS_PER_PLAYER:
+        reply(m, "⚠️ У тебя уже 2 картины.")
         return
 
     # берём file_id последней (крупной) копии
     file_id = m.photo[-1].file_id
 
     # реальная цена и стартовая (ниже реальной)
-    real = round10(random.randint(REAL_MIN, REAL_MAX))
-    start = max(REAL_MIN, real - random.choice(START_OFFSETS))
-    if start >= real:
-        start = max(REAL_MIN, real - 100)
-    start = round10(start)
-
-    lot = Lot(len(lots)+1, p.id, f"Картина #{len(lots)+1}", file_id, real, start)
-    lots.append(lot)
-    p.arts_created += 1
+    real, start = price_lot()
+
+    lot_id = g.ledger.next_id()
+    add_lot(g, p, Lot(lot_id, p.id, f"Картина #{lot_id}", file_id, real, start))
 
-    await m.answer(f"✅ Картина добавлена. (реальная стоимость скрыта, стартовая цена: {start})")
+    reply(m, f"✅ Картина добавлена. (реальная стоимость скрыта, стартовая цена: {start})")
 
+    await maybe_start_auction(g)
 
+async def maybe_start_auction(g: Game):
     # когда все по 2 — запускаем аукцион
-    if everyone_ready() and not current.get("auction_running"):
-        await m.answer("🔔 Все добавили по 2 картины. Через 2 сек начнём…", reply_markup=ReplyKeyboardRemove())
-        await asyncio.sleep(2)
-        await start_auction(m.chat.id)
+    if everyone_ready(g) and not g.auction_running:
+        g.auction_running = True  # чтобы второй «последний» рисунок не стартовал ещё раз
+        outbox.post(g.chat_id, "send_message", PRIO_LOT, chat_id=g.chat_id,
+                    text="🔔 Все добавили по 2 картины. Через 2 сек начнём…", reply_markup=ReplyKeyboardRemove())
+        g.start_handle = asyncio.get_running_loop().call_later(2, post_event, g, EV_START)
+
+# ====== РИСУНКИ: ШТРИХИ -> PNG ======
+# Рисовалка шлёт не PNG в base64 (не влезает в 4 КБ sendData), а штрихи:
+#   varint w, varint h, varint q            — холст w*q x h*q, точки в клетках q x q
+#   0 r g b                                 — цвет следующих штрихов
+#   1 width                                 — толщина в пикселях
+#   2 varint n, varint x0, varint y0, (zigzag varint dx, dy) * (n-1)
+# Байты сжаты deflate-raw (если браузер умеет, флаг "z") и закодированы base64url.
+# Сервер растеризует штрихи круглыми «штампами» построчными срезами bytearray
+# и собирает PNG на stdlib zlib — без Pillow.
+STROKE_MAX_BYTES = 256 * 1024      # после распаковки
+STROKE_MAX_POINTS = 50000
+STROKE_MAX_SIDE = 2000             # пикселей по стороне готовой картинки
+STROKE_MAX_WIDTH = 40
+STROKE_MAX_STAMP_ROWS = 300000     # строк круглых штампов на рисунок (≈0.5 с растеризации)
+OP_COLOR, OP_WIDTH, OP_STROKE = 0, 1, 2
+
+def _varint(buf: bytes, i: int) -> tuple:
+    v = shift = 0
+    while True:
+        b = buf[i]
+        i += 1
+        v |= (b & 0x7F) << shift
+        if b < 0x80:
+            return v, i
+        shift += 7
+        if shift > 28:
+            raise ValueError("varint too long")
+
+def _unzigzag(v: int) -> int:
+    return (v >> 1) ^ -(v & 1)
+
+def decode_strokes(data: str, deflated: bool) -> tuple:
+    """Строка из рисовалки -> (ширина, высота, шаг сетки, [(цвет, толщина, точки)])."""
+    raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    if deflated:
+        d = zlib.decompressobj(-15)
+        raw = d.decompress(raw, STROKE_MAX_BYTES)
+        if d.unconsumed_tail:
+            raise ValueError("strokes too large")
+    try:
+        w, i = _varint(raw, 0)
+        h, i = _varint(raw, i)
+        q, i = _varint(raw, i)
+        if not (w and h and q and w * q <= STROKE_MAX_SIDE and h * q <= STROKE_MAX_SIDE):
+            raise ValueError("bad canvas size")
+        color, width = b"\xff\xff\xff", 4
+        strokes = []
+        total = 0
+        while i < len(raw):
+            op = raw[i]
+            i += 1
+            if op == OP_COLOR:
+                color = bytes(raw[i:i + 3])
+                if len(color) != 3:
+                    raise ValueError("truncated strokes")
+                i += 3
+            elif op == OP_WIDTH:
+                width = min(max(raw[i], 1), STROKE_MAX_WIDTH)
+                i += 1
+            elif op == OP_STROKE:
+                n, i = _varint(raw, i)
+                total += n
+                if not n or total > STROKE_MAX_POINTS:
+                    raise ValueError("too many points")
+                x, i = _varint(raw, i)
+                y, i = _varint(raw, i)
+                pts = [(x, y)]
+                for _ in range(n - 1):
+                    dx, i = _varint(raw, i)
+                    dy, i = _varint(raw, i)
+                    x += _unzigzag(dx)
+                    y += _unzigzag(dy)
+                    pts.append((x, y))
+                # точки за холстом прижимаем к краю: палец уезжает за него и у честной
+                # рисовалки, а отрезок в 2^26 клеток растеризатор прошёл бы целиком
+                pts = [(min(max(px, 0), w), min(max(py, 0), h)) for px, py in pts]
+                strokes.append((color, width, pts))
+            else:
+                raise ValueError(f"unknown op {op}")
+    except IndexError:
+        raise ValueError("truncated strokes") from None
+    return w, h, q, strokes
+
+def _disc(width: int) -> list:
+    """Круг диаметра width построчно: [(dy, полуширина строки)]."""
+    r = width // 2
+    return [(dy, math.isqrt(r * r - dy * dy)) for dy in range(-r, r + 1)]
+
+def rasterize(w: int, h: int, q: int, strokes: list) -> tuple:
+    """Нарисовать штрихи на чёрном холсте. Возвращает (W, H, RGB-байты).
+    Штампов больше STROKE_MAX_STAMP_ROWS (в строках круга) — ValueError: поток
+    загрузчика держит GIL, и долгий рисунок тормозил бы цикл событий."""
+    W, H = w * q, h * q
+    row = W * 3
+    buf = bytearray(row * H)
+    discs: Dict[int, list] = {}
+    budget = STROKE_MAX_STAMP_ROWS
+    for color, width, pts in strokes:
+        spans = discs.get(width)
+        if spans is None:
+            spans = discs[width] = _disc(width)
+        step = max(1, width // 3)
+        prev = None
+        for x, y in pts:
+            X, Y = x * q, y * q
+            if prev is None:
+                n, centres = 1, ((X, Y),)
+            else:
+                px, py = prev
+                n = max(1, max(abs(X - px), abs(Y - py)) // step)
+                centres = ((px + (X - px) * k // n, py + (Y - py) * k // n) for k in range(1, n + 1))
+            budget -= n * len(spans)
+            if budget < 0:
+                raise ValueError("strokes too long")
+            for cx, cy in centres:
+                for dy, dx in spans:
+                    yy = cy + dy
+                    if 0 <= yy < H:
+                        x0 = max(0, cx - dx)
+                        x1 = min(W - 1, cx + dx)
+                        if x0 <= x1:
+                            base = yy * row
+                            buf[base + x0 * 3:base + x1 * 3 + 3] = color * (x1 - x0 + 1)
+            prev = (X, Y)
+    return W, H, buf
+
+def encode_png(w: int, h: int, rgb) -> bytes:
+    row = w * 3
+    mv = memoryview(rgb)
+    raw = b"".join(b"\x00" + mv[y * row:(y + 1) * row] for y in range(h))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6))
+            + chunk(b"IEND", b""))
+
+def drawing_png(kind: str, data: str | bytes) -> bytes:
+    """Данные из рисовалки -> байты PNG. Считается в потоке, не в цикле событий."""
+    if kind == "raw":
+        return data      # уже PNG (POST /upload)
+    if kind == "png":
+        return base64.b64decode(data, validate=True)
+    return encode_png(*rasterize(*decode_strokes(data, deflated=kind == "strokes+z")))
+
+# ====== ЗАГРУЗКА РИСУНКОВ ======
+class DrawingUploader:
+    """Фоновая загрузка рисунков ради file_id.
+
+    Обработчик только кладёт задание в ограниченную очередь (переполнена —
+    QueueFull, просим подождать). Воркеры считают sha256 присланных данных,
+    в потоке превращают их в PNG (base64 или растеризация штрихов) и грузят
+    картинку в STORAGE_CHAT_ID; одинаковые рисунки не декодируются и не
+    грузятся повторно — file_id берётся из кэша или из уже идущей загрузки."""
+
+    def __init__(self, workers: int = UPLOAD_WORKERS, maxsize: int = UPLOAD_QUEUE_MAX):
+        self.workers = workers
+        self.maxsize = maxsize
+        self._q: asyncio.Queue | None = None
+        self._tasks: List[asyncio.Task] = []
+        self.cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+        self.uploads = 0
+        self.hits = 0
+
+    def submit(self, chat_id: int, data: str | bytes, kind: str = "png") -> asyncio.Future:
+        if self._q is None:
+            self._q = asyncio.Queue(self.maxsize)
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        fut = asyncio.get_running_loop().create_future()
+        self._q.put_nowait((chat_id, kind, data, fut))   # QueueFull — это и есть back-pressure
+        return fut
+
+    async def _worker(self):
+        while True:
+            chat_id, kind, data, fut = await self._q.get()
+            try:
+                file_id = await self._file_id(chat_id, kind, data)
+            except Exception as e:
+                if not fut.done():
+                    fut.set_exception(e)
+            else:
+                if not fut.done():
+                    fut.set_result(file_id)
+            finally:
+                self._q.task_done()
+
+    async def _file_id(self, chat_id: int, kind: str, data: str | bytes) -> str:
+        raw = data if isinstance(data, bytes) else data.encode()
+        h = hashlib.sha256(kind.encode() + b":" + raw).digest()
+        file_id = self.cache.get(h)
+        if file_id is not None:
+            self.cache.move_to_end(h)
+            self.hits += 1
+            return file_id
+        pending = self._inflight.get(h)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+        pending = self._inflight[h] = asyncio.get_running_loop().create_future()
+        try:
+            raw = await asyncio.to_thread(drawing_png, kind, data)
+            file_id = await self._upload(chat_id, raw)
+        except Exception as e:
+            pending.set_exception(e)
+            pending.exception()  # помечаем как полученное — ждущих может не быть
+            raise
+        finally:
+            del self._inflight[h]
+        pending.set_result(file_id)
+        self.cache[h] = file_id
+        if len(self.cache) > FILE_ID_CACHE_MAX:
+            self.cache.popitem(last=False)
+        return file_id
+
+    async def _upload(self, chat_id: int, raw: bytes) -> str:
+        target = STORAGE_CHAT_ID or chat_id
+        img = BufferedInputFile(raw, filename="art.png")
+        msg = await outbox.call(target, "send_photo", PRIO_LOT,
+                                chat_id=target, photo=img, caption="🖌️ Рисунок получен.")
+        self.uploads += 1
+        if not STORAGE_CHAT_ID:
+            # своего склада нет — грузили в игровой чат, убираем служебное сообщение
+            outbox.post(target, "delete_message", PRIO_LOT, chat_id=target, message_id=msg.message_id)
+        return msg.photo[-1].file_id
+
+uploader = DrawingUploader()
 
 # ====== ПРИЁМ ДАННЫХ ИЗ WEB APP (рисовалка) ======
 @dp.message(F.web_app_data)
 async def on_web_app_data(m: types.Message):
     """
-    WebApp шлёт JSON строкой: {"title": "...", "png":"data:image/png;base64,...."}
+    WebApp шлёт JSON строкой: {"title": "...", "strokes": "<base64url>", "z": 1}
+    (штрихи, см. РИСУНКИ: ШТРИХИ -> PNG) или по-старому {"title": "...", "png": "data:image/png;base64,..."}
     """
-    p = ensure_player(m.from_user)
-    if p.arts_created >= MAX_ARTS_PER_PLAYER:
-        await m.answer("⚠️ У тебя уже 2 картины.")
+    g = get_game(m.chat.id)
+    p = ensure_player(g, m.from_user)
+    if p.arts_created + p.arts_pending >= MAX_ARTS_PER_PLAYER:
+        reply(m, "⚠️ У тебя уже 2 картины.")
         return
 
     try:
         data = json.loads(m.web_app_data.data)
-        title = (data.get("title") or "").strip() or f"Картина #{len(lots)+1}"
-        b64 = data.get("png", "")
-        if not b64.startswith("data:image/png;base64,"):
-            raise ValueError("wrong data url")
-        raw = base64.b64decode(b64.split(",", 1)[1])
+        title = (data.get("title") or "").strip()
+        if data.get("strokes"):
+            kind, payload = ("strokes+z" if data.get("z") else "strokes"), data["strokes"]
+        else:
+            png = data.get("png", "")
+            if not png.startswith("data:image/png;base64,"):
+                raise ValueError("wrong data url")
+            kind, payload = "png", png.split(",", 1)[1]
     except Exception:
-        await m.answer("Не удалось принять рисунок 😕 Попробуй ещё раз.")
+        reply(m, "Не удалось принять рисунок 😕 Попробуй ещё раз.")
         return
 
-    # загружаем картинку в Telegram, чтобы получить file_id
-    img = BufferedInputFile(raw, filename="art.png")
-    msg = await bot.send_photo(m.chat.id, img, caption="🖌️ Рисунок получен.")
-    file_id = msg.photo[-1].file_id
-    # чтобы не захламлять чат — можем удалить это служебное сообщение
+    # декодирование и загрузка — в фоне, обработчик освобождается сразу
     try:
-        await bot.delete_message(m.chat.id, msg.message_id)
-    except Exception:
-        pass
-
-    # цены
-    real = round10(random.randint(REAL_MIN, REAL_MAX))
-    start = max(REAL_MIN, real - random.choice(START_OFFSETS))
-    if start >= real:
-        start = max(REAL_MIN, real - 100)
-    start = round10(start)
-
-    lot = Lot(len(lots)+1, p.id, title, file_id, real, start)
-    lots.append(lot)
-    p.arts_created += 1
-    await m.answer(f"✅ Рисунок сохранён как «{title}». Стартовая цена: {start}")
-
-    if everyone_ready() and not current.get("auction_running"):
-        await m.answer("🔔 Все добавили по 2 картины. Через 2 сек начнём…", reply_markup=ReplyKeyboardRemove())
-        await asyncio.sleep(2)
-        await start_auction(m.chat.id)
+        queue_drawing(g, p, title, payload, kind)
+    except asyncio.QueueFull:
+        reply(m, "⏳ Сейчас много рисунков в обработке. Попробуй через минуту.")
+        return
 
-# ====== СТАРТ АУКЦИОНА ======
-async def start_auction(chat_id: int):
-    current["auction_running"] = True
-    # формируем очередь и мешаем
-    queue[:] = [l.id for l in lots]
-    random.shuffle(queue)
-    await next_lot(chat_id)
+def queue_drawing(g: Game, p: Player, title: str, data, kind: str):
+    """Отдать рисунок загрузчику; лот заведёт finish_drawing. Очередь полна — QueueFull."""
+    fut = uploader.submit(g.chat_id, data, kind)
+    p.arts_pending += 1
+    asyncio.create_task(finish_drawing(g, p, title, fut))
 
-async def next_lot(chat_id: int):
-    # отменяем старый таймер
-    t = current.get("timer_task")
-    if t and not t.done():
-        t.cancel()
-        with contextlib.suppress(Exception):
-            await t
-
-    if not queue:
-        current["auction_running"] = False
-        await show_results(chat_id)
+async def finish_drawing(g: Game, p: Player, title: str, fut: asyncio.Future):
+    """Загрузка закончилась — заводим лот (или сообщаем об ошибке)."""
+    try:
+        file_id = await fut
+    except Exception:
+        outbox.post(g.chat_id, "send_message", PRIO_LOT, chat_id=g.chat_id,
+                    text="Не удалось принять рисунок 😕 Попробуй ещё раз.")
         return
+    finally:
+        p.arts_pending -= 1
+    if games.get(g.chat_id) is not g:
+        return  # партию сбросили, пока грузили
 
-    lot_id = queue.pop(0)
-    lot = next(l for l in lots if l.id == lot_id)
+    # цены
+    real, start = price_lot()
 
-    active_ids = [pid for pid in players if pid != lot.author_id]
-    if not active_ids:
-        # никому продавать
-        lot.sold_to = lot.author_id
-        lot.sold_price = 0
-        await bot.send_message(chat_id, f"⚠️ Лот №{lot.id} остался у автора (нет покупателей).")
-        await next_lot(chat_id)
-        return
+    lot_id = g.ledger.next_id()
+    title = title or f"Картина #{lot_id}"
+    add_lot(g, p, Lot(lot_id, p.id, title, file_id, real, start))
+    outbox.post(g.chat_id, "send_message", PRIO_LOT, chat_id=g.chat_id,
+                text=f"✅ Рисунок сохранён как «{title}». Стартовая цена: {start}")
 
-    current.update({
-        "chat_id": chat_id,
-        "lot": lot,
-        "active_ids": active_ids,
-        "price": lot.start_price,
-        "leader": None,
-        "passed": set(),
-        "photo_msg_id": None,
-        "timer_msg_id": None,
-        "timer_task": None,
-    })
-
-    # публикуем лот (без автора/названия)
-    caption = f"🎨 ЛОТ №{lot.id}\n💰 Стартовая цена: {lot.start_price}\nНажимайте на ставки или «Пасс»."
-    msg = await bot.send_photo(chat_id, lot.file_id, caption=caption, reply_markup=make_bid_keyboard(lot.start_price))
-    current["photo_msg_id"] = msg.message_id
-
-    # отдельное сообщение-таймер
-    tmsg = await bot.send_message(chat_id, f"⏳ Осталось: {BID_TIMER_SEC} сек.")
-    current["timer_msg_id"] = tmsg.message_id
-    current["timer_task"] = asyncio.create_task(run_timer())
-
-async def run_timer():
-    """Отдельный таймер: тикает, редактирует сообщение, завершает лот при нуле."""
-    try:
-        sec = BID_TIMER_SEC
-        while sec > 0:
-            await asyncio.sleep(1)
-            sec -= 1
-            # может уже финализирован
-            if not current["lot"]:
-                return
-            try:
-                await bot.edit_message_text(f"⏳ Осталось: {sec} сек.", chat_id=current["chat_id"], message_id=current["timer_msg_id"])
-            except Exception:
-                pass
+    await maybe_start_auction(g)
 
-        # таймер истёк
-        if current["leader"] is not None:
-            await finalize_sale(reason="⏰ Время вышло")
+def add_lot(g: Game, p: Player, lot: Lot):
+    g.ledger.add(lot)
+    p.arts_created += 1
+    journal.record("lot", g.chat_id, id=lot.id, author=lot.author_id, title=lot.title,
+                   file_id=lot.file_id, real=lot.real_value, start=lot.start_price)
+    event_log.emit("lot", g.chat_id, l=lot.id, u=lot.author_id, p=lot.start_price, real=lot.real_value,
+                   title=lot.title)
+
+# ====== ХОД АУКЦИОНА ======
+# Каждая партия — конечный автомат с одной очередью событий и одним потребителем.
+# Ставки, пассы, дедлайны и «фото лота отправлено» приходят событиями, так что
+# состояние торгов меняет ровно одна задача: без блокировок и без гонок таймера
+# со ставкой. Сеть внутри потребителя не ждём — фото лота шлёт отдельная задача
+# и сообщает о результате событием EV_OPENED.
+EV_START, EV_NEXT, EV_OPENED, EV_BID, EV_PASS, EV_DEADLINE = range(6)
+
+def post_event(g: Game, kind: int, *args, reply: bool = False) -> asyncio.Future | None:
+    """Положить событие в очередь партии; reply=True — вернуть future с ответом автомата."""
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future() if reply else None
+    if g.dropped:
+        # партию сбросили: поздние события (фото лота, таймеры) уходят в никуда
+        if fut is not None:
+            fut.set_result(None)
+        return fut
+    g.events.put_nowait((kind, args, fut, current_trace.get()))
+    if g.consumer is None or g.consumer.done():
+        g.consumer = loop.create_task(run_game(g))
+    return fut
+
+async def run_game(g: Game):
+    """Единственный потребитель событий партии."""
+    q = g.events
+    while True:
+        kind, args, fut, tr = await q.get()
+        t0 = time.perf_counter()
+        token = current_trace.set(tr)   # вызовы, поставленные событием, — в трассу его апдейта
+        try:
+            result = EVENT_HANDLERS[kind](g, *args)
+        except Exception as e:
+            log.exception("game %s: event %s failed", g.chat_id, kind)
+            if fut is not None and not fut.done():
+                fut.set_exception(e)
         else:
-            # никто не сделал ставки
-            lot: Lot = current["lot"]
-            lot.sold_to = lot.author_id
-            lot.sold_price = 0
-            await bot.edit_message_caption(
-                chat_id=current["chat_id"], message_id=current["photo_msg_id"],
-                caption=f"🎨 ЛОТ №{lot.id}\n❌ Никто не сделал ставку. Лот остался у автора.",
-                reply_markup=None
-            )
-            await cleanup_after_lot()
-            await next_lot(current["chat_id"])
-    except asyncio.CancelledError:
-        # сбросили таймер (кто-то поставил)
+            if fut is not None and not fut.done():
+                fut.set_result(result)
+        finally:
+            current_trace.reset(token)
+            if tr is not None:
+                tr.span(EVENT_SPANS[kind], t0)
+
+def start_auction(g: Game):
+    g.auction_running = True
+    g.start_handle = None
+    # формируем очередь и мешаем
+    g.ledger.shuffle_queue()
+    journal.record("start", g.chat_id, queue=list(g.ledger.queue))
+    event_log.emit("start", g.chat_id, queue=list(g.ledger.queue))
+    prepare_next_lot(g)
+    next_lot(g)
+
+def lot_caption(g: Game, sec: int) -> str:
+    """Подпись идущего лота: цена/лидер и оставшееся время (таймер живёт прямо в подписи)."""
+    lot = g.lot
+    if g.leader is None:
+        return lot_open_caption(lot.id, lot.start_price, sec)
+    return lot_bid_caption(lot.id, g.price, g.players[g.leader].name, sec)
+
+def prepare_next_lot(g: Game):
+    """Пока идут торги, заранее собираем подпись и клавиатуру следующего лота."""
+    g.prepared = None
+    if not g.ledger.queue:
         return
+    lot = g.ledger.by_id[g.ledger.queue[0]]
+    g.prepared = (lot, lot_open_caption(lot.id, lot.start_price, BID_TIMER_SEC), make_bid_keyboard(lot.start_price))
 
-async def cleanup_after_lot():
-    # удалить таймер-сообщение
-    try:
-        if current["timer_msg_id"]:
-            await bot.delete_message(current["chat_id"], current["timer_msg_id"])
-    except Exception:
-        pass
-    current["timer_msg_id"] = None
-    # остановить и забыть таймер
-    t = current.get("timer_task")
-    if t and not t.done():
-        t.cancel()
-        with contextlib.suppress(Exception):
-            await t
-    current["timer_task"] = None
-    # обнулить контекст лота
-    current["lot"] = None
-    current["leader"] = None
-    current["passed"] = set()
-    current["active_ids"] = []
-
-async def finalize_sale(reason: str):
-    lot: Lot = current["lot"]
-    leader_id = current["leader"]
-    price = current["price"]
-    buyer = players[leader_id]
-    # списываем деньги
-    buyer.money -= price
-    lot.sold_to = leader_id
-    lot.sold_price = price
-
+def next_lot(g: Game):
+    """Открыть следующий лот: фаза OPENING, фото уходит в фоне."""
+    # отменяем старый таймер
+    scheduler.cancel(g)
+
+    # лоты без покупателей пропускаем циклом, а не рекурсией
+    while True:
+        lot = g.ledger.pop_next()
+        if lot is None:
+            g.auction_running = False
+            g.phase = PHASE_IDLE
+            show_results(g)
+            return
+        if open_lot(g, lot, g.players):
+            break
+        # никому продавать
+        settle_lot(g, lot, lot.author_id)
+        outbox.post(g.chat_id, "send_message", PRIO_LOT, chat_id=g.chat_id,
+                    text=f"⚠️ Лот №{lot.id} остался у автора (нет покупателей).")
+
+    g.phase = PHASE_OPENING
+    g.photo_msg_id = None
+
+    # публикуем лот (без автора/названия); таймер — последней строкой подписи
+    prepared, g.prepared = g.prepared, None
+    if prepared is not None and prepared[0] is lot:
+        _, caption, markup = prepared
+    else:
+        caption, markup = lot_caption(g, BID_TIMER_SEC), make_bid_keyboard(lot.start_price)
+    asyncio.create_task(send_lot(g, lot, caption, markup))
+
+async def send_lot(g: Game, lot: Lot, caption: str, markup: InlineKeyboardMarkup):
     try:
-        await bot.edit_message_caption(
-            chat_id=current["chat_id"], message_id=current["photo_msg_id"],
-            caption=f"✅ {reason} — ЛОТ №{lot.id} продан {buyer.name} за {price} 💰\n"
-                    f"💎 Реальная стоимость будет раскрыта в финале.",
-            reply_markup=None
-        )
+        msg = await outbox.call(g.chat_id, "send_photo", PRIO_LOT, chat_id=g.chat_id, photo=lot.file_id,
+                                caption=caption, reply_markup=markup)
     except Exception:
-        pass
-
-    await cleanup_after_lot()
-    await asyncio.sleep(1)
-    await next_lot(current["chat_id"])
+        post_event(g, EV_OPENED, lot, None)
+        return
+    post_event(g, EV_OPENED, lot, msg.message_id)
 
-# ====== КОЛБЭКИ СТАВОК / ПАСС ======
-@dp.callback_query(F.data.startswith("bid:"))
-async def on_bid(c: types.CallbackQuery):
-    if not current["lot"]:
-        await c.answer("Сейчас нет активного лота.", show_alert=True)
+def on_lot_opened(g: Game, lot: Lot, message_id: int | None):
+    if g.lot is not lot or g.phase != PHASE_OPENING:
         return
-    uid = c.from_user.id
-    if uid not in current["active_ids"]:
-        await c.answer("Автор не может ставить на свой лот.", show_alert=True)
+    if message_id is None:
+        # фото не ушло — лот остаётся у автора, идём дальше
+        settle_lot(g, lot, lot.author_id)
+        cleanup_after_lot(g)
+        next_lot(g)
+        return
+    g.photo_msg_id = message_id
+    g.phase = PHASE_BIDDING
+    scheduler.start(g)
+    journal.record("open", g.chat_id, id=lot.id, active=g.active_ids, price=g.price,
+                   photo=g.photo_msg_id, until=time.time() + BID_TIMER_SEC)
+    event_log.emit("open", g.chat_id, l=lot.id, p=g.price, active=g.active_ids)
+    prepare_next_lot(g)
+
+def refresh_lot_message(g: Game, prio: int):
+    """Перерисовать подпись и кнопки идущего лота по текущему состоянию.
+    Правки одного сообщения схлопываются в outbox — уходит только последняя."""
+    if g.phase != PHASE_BIDDING or g.deadline is None:
         return
+    sec = max(1, math.ceil(g.deadline - time.monotonic()))
+    g.shown_sec = sec
+    outbox.post(
+        g.chat_id, "edit_message_caption", prio, key=(g.chat_id, g.photo_msg_id),
+        chat_id=g.chat_id, message_id=g.photo_msg_id,
+        caption=lot_caption(g, sec), reply_markup=make_bid_keyboard(g.price)
+    )
 
-    new_price = int(c.data.split(":")[1])
-    # цены всегда «круглые»
-    new_price = round10(new_price)
+def on_lot_deadline(g: Game, gen: int):
+    """Время лота вышло: продаём лидеру или оставляем у автора."""
+    if g.phase != PHASE_BIDDING or gen != g.timer_gen:
+        return  # ставка успела сдвинуть дедлайн или лот уже закрыт
+    TIMER_DRIFT.observe(max(0.0, time.monotonic() - g.deadline))
+    if deadline_outcome(g) == PASS_SOLD:
+        finalize_sale(g, reason="⏰ Время вышло")
+    else:
+        # никто не сделал ставки
+        keep_with_author(g, "❌ Никто не сделал ставку. Лот остался у автора.")
+
+def keep_with_author(g: Game, text: str):
+    lot: Lot = g.lot
+    settle_lot(g, lot, lot.author_id)
+    outbox.post(
+        g.chat_id, "edit_message_caption", PRIO_SALE, key=(g.chat_id, g.photo_msg_id),
+        chat_id=g.chat_id, message_id=g.photo_msg_id,
+        caption=lot_kept_caption(lot.id, text),
+        reply_markup=None
+    )
+    cleanup_after_lot(g)
+    next_lot(g)
+
+def cleanup_after_lot(g: Game):
+    # остановить и забыть таймер и отложенную подпись
+    scheduler.cancel(g)
+    if g.caption_handle is not None:
+        g.caption_handle.cancel()
+        g.caption_handle = None
+    # обнулить контекст лота
+    g.phase = PHASE_IDLE
+    g.lot = None
+    g.leader = None
+    g.passed = set()
+    g.active_ids = []
+
+def finalize_sale(g: Game, reason: str):
+    lot: Lot = g.lot
+    leader_id = g.leader
+    price = g.price
+    buyer = g.players[leader_id]
+    # списываем деньги и записываем покупку
+    settle_lot(g, lot, leader_id, price)
+
+    outbox.post(
+        g.chat_id, "edit_message_caption", PRIO_SALE, key=(g.chat_id, g.photo_msg_id),
+        chat_id=g.chat_id, message_id=g.photo_msg_id,
+        caption=lot_sold_caption(reason, lot.id, buyer.name, price),
+        reply_markup=None
+    )
 
-    p = players[uid]
-    if p.money < new_price:
-        await c.answer("Недостаточно монет 💸", show_alert=True)
-        return
-    if new_price <= current["price"]:
-        await c.answer("Ставка должна быть больше текущей.", show_alert=True)
-        return
+    cleanup_after_lot(g)
+    # без паузы: подпись продажи (PRIO_SALE) уйдёт в чат раньше фото следующего лота
+    next_lot(g)
 
-    # принимаем ставку
-    current["price"] = new_price
-    current["leader"] = uid
-    current["passed"] = set()  # все «Пассы» обнуляем
+BID_REJECTS = {
+    BID_AUTHOR: "Автор не может ставить на свой лот.",
+    BID_NO_MONEY: "Недостаточно монет 💸",
+    BID_TOO_LOW: "Ставка должна быть больше текущей.",
+}
 
-    # обновляем подпись лота и кнопки
-    try:
-        await bot.edit_message_caption(
-            chat_id=current["chat_id"], message_id=current["photo_msg_id"],
-            caption=f"🎨 ЛОТ №{current['lot'].id}\n📈 Текущая ставка: {current['price']} (от {p.name})",
-            reply_markup=make_bid_keyboard(current["price"])
-        )
-    except Exception:
-        pass
+def apply_bid(g: Game, uid: int, new_price: int) -> tuple:
+    """Ставка внутри автомата. Возвращает (текст ответа, show_alert)."""
+    if g.phase != PHASE_BIDDING:
+        return "Сейчас нет активного лота.", True
+    verdict = place_bid(g, g.players, uid, new_price)
+    # отказы тоже пишем: по ним разбираются споры «я же ставил»
+    event_log.emit("bid", g.chat_id, l=g.lot.id, u=uid, p=new_price, r=verdict, left=time_left(g))
+    if verdict != BID_OK:
+        return BID_REJECTS[verdict], True
+
+    # ставка принята (цена и лидер уже новые): дедлайн снова через 10 сек,
+    # новое время покажет подпись ставки
+    scheduler.extend(g)
+    journal.record("bid", g.chat_id, uid=uid, price=g.price, until=time.time() + BID_TIMER_SEC)
+    # подпись и кнопки — отложенно, с последней ценой
+    schedule_caption_refresh(g)
+    return "Ставка принята ✅", False
+
+def apply_pass(g: Game, uid: int) -> str | None:
+    """Пасс внутри автомата. Возвращает текст ответа (None — молча)."""
+    if g.phase != PHASE_BIDDING:
+        return None
+    outcome = place_pass(g, uid)
+    if outcome == PASS_IGNORED:
+        return None   # автор лота или посторонний
+    journal.record("pass", g.chat_id, uid=uid)
+    event_log.emit("pass", g.chat_id, l=g.lot.id, u=uid, left=time_left(g))
+    if outcome == PASS_SOLD:
+        finalize_sale(g, reason="🛎 Все пасс")
+    elif outcome == PASS_KEPT:
+        keep_with_author(g, "❌ Все пасс. Лот остался у автора.")
+    return "🚫 Пасс"
+
+EVENT_SPANS = {
+    EV_START: "game:start",
+    EV_NEXT: "game:next",
+    EV_OPENED: "game:opened",
+    EV_BID: "game:bid",
+    EV_PASS: "game:pass",
+    EV_DEADLINE: "game:deadline",
+}
+
+EVENT_HANDLERS = {
+    EV_START: start_auction,
+    EV_NEXT: next_lot,
+    EV_OPENED: on_lot_opened,
+    EV_BID: apply_bid,
+    EV_PASS: apply_pass,
+    EV_DEADLINE: on_lot_deadline,
+}
 
-    # сброс таймера
-    t = current.get("timer_task")
-    if t and not t.done():
-        t.cancel()
-        with contextlib.suppress(Exception):
-            await t
-    # перезапускаем таймер заново на 10 сек
-    tm = await bot.edit_message_text(f"⏳ Осталось: {BID_TIMER_SEC} сек.", chat_id=current["chat_id"], message_id=current["timer_msg_id"])
-    current["timer_msg_id"] = tm.message_id
-    current["timer_task"] = asyncio.create_task(run_timer())
+# ====== ФОНОВЫЕ ПОБОЧНЫЕ ЭФФЕКТЫ ======
+# Обработчик колбэка только решает, что ответить; сам ответ и прочие вызовы Telegram
+# уходят в ChatExecutor: с одним ключом (обычно chat_id) — строго по очереди, с разными —
+# параллельно, не больше EFFECT_WORKERS одновременно и не больше EFFECT_QUEUE_MAX в
+# ожидании (сверх — отбрасываем с предупреждением: под перегрузкой важнее не копить очередь).
+EFFECT_WORKERS = 32
+EFFECT_QUEUE_MAX = 10000
+
+class ChatExecutor:
+    def __init__(self, workers: int = EFFECT_WORKERS, max_pending: int = EFFECT_QUEUE_MAX,
+                 name: str = "side effect"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.name = name
+        self._chains: Dict[Any, deque] = {}   # ключ порядка -> очередь (функция, аргументы)
+        self._sem: asyncio.Semaphore | None = None
+        self._room: asyncio.Event | None = None
+        self.pending = 0
+        self.dropped = 0
+
+    def submit(self, key, fn, *args, **kwargs) -> bool:
+        """Поставить корутинную функцию в очередь ключа key. False — переполнено."""
+        if self.pending >= self.max_pending:
+            self.dropped += 1
+            log.warning("%s queue full, dropped %s for %s", self.name, fn.__name__, key)
+            return False
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.workers)
+        chain = self._chains.get(key)
+        if chain is None:
+            chain = self._chains[key] = deque()
+            asyncio.get_running_loop().create_task(self._drain(key, chain))
+        chain.append((fn, args, kwargs, current_trace.get()))
+        self.pending += 1
+        return True
+
+    async def wait_room(self):
+        """Дождаться места в очереди — для входов, которым нельзя терять работу."""
+        while self.pending >= self.max_pending:
+            if self._room is None:
+                self._room = asyncio.Event()
+            self._room.clear()
+            await self._room.wait()
+
+    async def _drain(self, key, chain: deque):
+        try:
+            while chain:
+                fn, args, kwargs, tr = chain.popleft()
+                current_trace.set(tr)   # задача цепочки своя, контекст не утечёт
+                try:
+                    async with self._sem:
+                        await fn(*args, **kwargs)
+                except Exception:
+                    EFFECT_ERRORS.inc(fn.__name__)
+                    log.exception("%s %s failed for %s", self.name, fn.__name__, key)
+                finally:
+                    self.pending -= 1
+                    if self._room is not None and self.pending < self.max_pending:
+                        self._room.set()
+        finally:
+            del self._chains[key]
+
+effects = ChatExecutor()
+
+ACK_FAILED = "😕 Не получилось, попробуй ещё раз."
+ACK_BUSY = "⏳ Бот перегружен, попробуй ещё раз."
+
+def ack_first(handler):
+    """Колбэк-обработчик возвращает ответ — текст или (текст, show_alert) — а не шлёт его сам.
+    Ответ уходит из фона, задача апдейта освобождается, не дожидаясь сети. Ответ уходит
+    всегда: упал обработчик — ACK_FAILED, очередь эффектов полна — ACK_BUSY прямо отсюда,
+    иначе кнопка крутилась бы, пока Telegram не сдастся."""
+    @functools.wraps(handler)
+    async def wrapper(c: types.CallbackQuery):
+        text, alert = ACK_FAILED, None
+        try:
+            answer = await handler(c)
+            text, alert = answer if isinstance(answer, tuple) else (answer, None)
+        finally:
+            # ответы на разные колбэки друг от друга не зависят — свой ключ, без очереди за чатом
+            if not effects.submit(("ack", c.id), c.answer, text, show_alert=alert):
+                with contextlib.suppress(Exception):   # отказ уже в логе effects
+                    await c.answer(ACK_BUSY)
+    return wrapper
 
-    await c.answer("Ставка принята ✅")
+# ====== КОЛБЭКИ СТАВОК / ПАСС ======
+@dp.callback_query(F.data.startswith("bid:"))
+@ack_first
+async def on_bid(c: types.CallbackQuery):
+    g = games.get(c.message.chat.id) if c.message else None
+    if g is None or g.phase != PHASE_BIDDING:
+        return "Сейчас нет активного лота.", True
+    get_game(g.chat_id)  # отметить активность
+    return await post_event(g, EV_BID, c.from_user.id, int(c.data.split(":")[1]), reply=True)
+
+def schedule_caption_refresh(g: Game):
+    """Обновить подпись лота не раньше чем через CAPTION_DEBOUNCE_SEC; ставки внутри окна
+    схлопываются в одну правку с актуальной ценой."""
+    if g.caption_handle is None:
+        g.caption_handle = asyncio.get_running_loop().call_later(
+            CAPTION_DEBOUNCE_SEC, flush_bid_caption, g, g.lot)
+
+def flush_bid_caption(g: Game, lot: Lot):
+    g.caption_handle = None
+    if g.lot is not lot:
+        return  # лот уже закрыт — подпись поставит продажа
+    refresh_lot_message(g, PRIO_BID)
 
 @dp.callback_query(F.data == "pass")
+@ack_first
 async def on_pass(c: types.CallbackQuery):
-    if not current["lot"]:
-        await c.answer()
-        return
-    uid = c.from_user.id
-    # учитывать только участников (не автора)
-    if uid not in current["active_ids"]:
-        await c.answer()
-        return
-
-    # записываем пасс
-    current["passed"].add(uid)
-    await c.answer("🚫 Пасс")
-
-    # если есть лидер и ВСЕ КРОМЕ НЕГО пассанули — продаём сразу
-    if current["leader"] is not None:
-        others = set(current["active_ids"]) - {current["leader"]}
-        if others.issubset(current["passed"]) and others:
-            await finalize_sale(reason="🛎 Все пасс")
-            return
+    g = games.get(c.message.chat.id) if c.message else None
+    if g is None or g.phase != PHASE_BIDDING:
+        return None
+    get_game(g.chat_id)
+    return await post_event(g, EV_PASS, c.from_user.id, reply=True)
+
+# ====== АНТИФЛУД ======
+# Внешний middleware колбэков ставок и пасса: до фильтров, автомата партии и правок
+# подписи отбиваем то, что заведомо ничего не изменит, — клик по уже закрытому лоту
+# (сообщение не то, что сейчас на торгах), ставку не выше текущей цены, повторный пасс,
+# ставку автора — и частые клики: токен-бакеты на игрока и на чат. Состояние читаем
+# без автомата, но только то, что в пределах лота не откатывается (цена лишь растёт),
+# так что отбитое автомат отклонил бы и сам. Ответы на отказы копятся и уходят
+# пачкой раз в FLOOD_FLUSH_SEC.
+FLOOD_USER_RATE = 3.0       # кликов в секунду на игрока в чате
+FLOOD_USER_BURST = 6
+FLOOD_CHAT_RATE = 30.0      # кликов в секунду на чат
+FLOOD_CHAT_BURST = 60
+FLOOD_BUCKETS_MAX = 50000   # бакетов в памяти (LRU)
+FLOOD_FLUSH_SEC = 0.05
+
+FLOOD_ANSWERS = {
+    "closed": ("Сейчас нет активного лота.", True),
+    "outbid": ("Ставка должна быть больше текущей.", True),
+    "author": (BID_REJECTS[BID_AUTHOR], True),
+    "passed": ("🚫 Пасс", False),
+    "ignored": (None, False),   # пасс автора лота — молча, как в apply_pass
+    "user": ("⏳ Не так часто!", False),
+    "chat": ("⏳ Не так часто!", False),
+}
 
-    # если никто не ставил и все пассанули — лот к автору
-    if current["leader"] is None and set(current["active_ids"]).issubset(current["passed"]):
-        lot: Lot = current["lot"]
-        lot.sold_to = lot.author_id
-        lot.sold_price = 0
+flood_buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+
+def flood_bucket(key: tuple, rate: float, burst: int) -> TokenBucket:
+    b = flood_buckets.get(key)
+    if b is None:
+        b = flood_buckets[key] = TokenBucket(rate, burst)
+        if len(flood_buckets) > FLOOD_BUCKETS_MAX:
+            flood_buckets.popitem(last=False)
+    else:
+        flood_buckets.move_to_end(key)
+    return b
+
+def flood_verdict(c: types.CallbackQuery) -> str | None:
+    """Причина отбить колбэк ставки/пасса до обработчика; None — пропустить."""
+    data = c.data or ""
+    is_pass = data == "pass"
+    if not (is_pass or data.startswith("bid:")) or c.message is None:
+        return None
+    g = games.get(c.message.chat.id)
+    if g is None or g.phase != PHASE_BIDDING or c.message.message_id != g.photo_msg_id:
+        return "closed"
+    uid = c.from_user.id
+    if uid not in g.active_ids:
+        return "ignored" if is_pass else "author"
+    if is_pass:
+        if uid in g.passed:
+            return "passed"
+    else:
         try:
-            await bot.edit_message_caption(
-                chat_id=current["chat_id"], message_id=current["photo_msg_id"],
-                caption=f"🎨 ЛОТ №{lot.id}\n❌ Все пасс. Лот остался у автора.",
-                reply_markup=None
-            )
-        except Exception:
-            pass
-        await cleanup_after_lot()
-        await next_lot(current["chat_id"])
+            price = round10(int(data[4:]))
+        except ValueError:
+            return "closed"
+        if price <= g.price:
+            return "outbid"
+    now = time.monotonic()
+    # сначала свой бакет: один спамер не должен выедать бакет всего чата
+    user = flood_bucket((g.chat_id, uid), FLOOD_USER_RATE, FLOOD_USER_BURST)
+    if user.delay(now):
+        return "user"
+    chat = flood_bucket((g.chat_id,), FLOOD_CHAT_RATE, FLOOD_CHAT_BURST)
+    if chat.delay(now):
+        return "chat"
+    user.take()
+    chat.take()
+    return None
+
+class RejectBatch:
+    """Ответы на отбитые колбэки: копятся и уходят одной фоновой пачкой."""
+
+    def __init__(self):
+        self.items: list = []
+        self.handle: asyncio.TimerHandle | None = None
+
+    def add(self, c: types.CallbackQuery, text: str, alert: bool):
+        self.items.append((c, text, alert, current_trace.get()))
+        if self.handle is None:
+            # пустой контекст: пачка не должна унаследовать трассу первого отказа
+            self.handle = asyncio.get_running_loop().call_later(
+                FLOOD_FLUSH_SEC, self.flush, context=contextvars.Context())
+
+    def flush(self):
+        self.handle = None
+        items, self.items = self.items, []
+        effects.submit(("rejects", id(items)), self._send, items)
+
+    @staticmethod
+    async def _send(items: list):
+        await asyncio.gather(*(RejectBatch._answer(*item) for item in items), return_exceptions=True)
+
+    @staticmethod
+    async def _answer(c: types.CallbackQuery, text: str, alert: bool, tr: Trace | None):
+        current_trace.set(tr)   # у каждого ответа своя задача gather — и своя трасса
+        await bot.answer_callback_query(c.id, text=text, show_alert=alert)
+
+rejects = RejectBatch()
+
+class AntiFlood(BaseMiddleware):
+    async def __call__(self, handler, event: types.CallbackQuery, data):
+        reason = flood_verdict(event)
+        if reason is None:
+            return await handler(event, data)
+        FLOOD_DROPPED.inc(reason)
+        rejects.add(event, *FLOOD_ANSWERS[reason])
+
+dp.callback_query.outer_middleware(AntiFlood())
 
 # ====== ФИНАЛ ======
-async def show_results(chat_id: int):
+def show_results(g: Game):
     # раскрываем авторов/названия/реальные стоимости
     lines = ["🏁 Аукцион завершён!\n"]
-    for l in lots:
-        author = players[l.author_id].name
-        if l.sold_to:
-            buyer = players[l.sold_to].name
-            lines.append(f"🎨 Лот №{l.id} — «{l.title}» (автор: {author})\n"
-                         f"   🏷 Продан {buyer} за {l.sold_price} 💰 | 💎 Реальная стоимость: {l.real_value}\n")
-        else:
-            lines.append(f"🎨 Лот №{l.id} — «{l.title}» (автор: {author})\n"
-                         f"   ❌ Не продан | 💎 Реальная стоимость: {l.real_value}\n")
+    for l in g.ledger.lots:
+        author = g.players[l.author_id].name
+        lines.append(result_lot_line(l, author, g.players[l.sold_to].name if l.sold_to else None))
 
     # турнирная таблица
-    rating = []
-    for p in players.values():
-        cap = compute_capital(p)
-        value_sum = sum(l.real_value for l in lots if l.sold_to == p.id)
-        rating.append((cap, p, value_sum))
-    rating.sort(key=lambda x: x[0], reverse=True)
+    rating = g.ledger.ranking(g.players.values())
 
     lines.append("🏆 Итоги:")
     for i, (cap, p, value_sum) in enumerate(rating, start=1):
-        lines.append(f"{i}. {p.name} — капитал: {cap} 💰 (баланс: {p.money}, картины: {value_sum}, кредит: {'да' if p.loan else 'нет'})")
-
-    await bot.send_message(chat_id, "\n".join(lines), reply_markup=restart_kb())
+        lines.append(result_rank_line(i, p, cap, value_sum))
+
+    g.finished = True
+    journal.record("finish", g.chat_id)
+    event_log.emit("result", g.chat_id, rank=[[p.id, cap] for cap, p, _ in rating])
+    # большие партии не влезают в одно сообщение — шлём страницами, кнопка на последней
+    pages = paginate(lines)
+    for i, page in enumerate(pages):
+        last = i == len(pages) - 1
+        outbox.post(g.chat_id, "send_message", PRIO_SALE, chat_id=g.chat_id,
+                    text=page, reply_markup=restart_kb() if last else None)
 
 # ====== ПРОСТОЙ ВЕБ-СЕРВЕР С РИСОВАЛКОЙ ======
 # (Для реального Telegram добавь HTTPS через ngrok и пропиши DRAW_WEBAPP_URL)
-import contextlib
-from aiohttp import web
+from aiohttp import ClientSession, web
 
 DRAW_HTML = """<!doctype html>
 <html lang="ru">
@@ -599,92 +2255,677 @@ DRAW_HTML = """<!doctype html>
             padding: 5px;
         }
     </style>
+    <script src="https://telegram.org/js/telegram-web-app.js"></script>
 </head>
 <body>
     <h1>🎨 Рисовалка</h1>
     <canvas id="canvas" width="800" height="500"></canvas>
     <div class="controls">
+        <input type="text" id="title" placeholder="Название" maxlength="64">
         <input type="color" id="color" class="color-picker" value="#ffffff">
         <input type="range" id="size" class="size-picker" min="1" max="20" value="4">
         <button class="clear" onclick="clearCanvas()">Очистить</button>
-        <button class="save" onclick="saveCanvas()">Сохранить</button>
+        <button class="save" onclick="saveCanvas()">Отправить</button>
     </div>
 
     <script>
         const canvas = document.getElementById("canvas");
         const ctx = canvas.getContext("2d");
+        const Q = 2;            // шаг сетки точек, px
+        const LIMIT = 4096;     // предел sendData, байт
         let painting = false;
         let color = document.getElementById("color").value;
-        let size = document.getElementById("size").value;
+        let size = parseInt(document.getElementById("size").value);
+        let strokes = [];       // {c: "#rrggbb", w: толщина, pts: [x0, y0, x1, y1, ...] в клетках Q}
+        let stroke = null;
 
         document.getElementById("color").addEventListener("change", (e) => {
             color = e.target.value;
         });
 
         document.getElementById("size").addEventListener("input", (e) => {
-            size = e.target.value;
+            size = parseInt(e.target.value);
         });
 
+        function point(e) {
+            const rect = canvas.getBoundingClientRect();
+            const p = e.touches ? e.touches[0] : e;
+            const x = Math.round((p.clientX - rect.left) * canvas.width / rect.width);
+            const y = Math.round((p.clientY - rect.top) * canvas.height / rect.height);
+            return [Math.max(0, Math.min(canvas.width, x)), Math.max(0, Math.min(canvas.height, y))];
+        }
         function startPosition(e) {
             painting = true;
+            stroke = {c: color, w: size, pts: []};
+            strokes.push(stroke);
             draw(e);
         }
         function endPosition() {
             painting = false;
+            stroke = null;
             ctx.beginPath();
         }
         function draw(e) {
             if (!painting) return;
+            e.preventDefault();
+            const [x, y] = point(e);
+            const qx = Math.round(x / Q), qy = Math.round(y / Q), n = stroke.pts.length;
+            if (n && stroke.pts[n - 2] === qx && stroke.pts[n - 1] === qy) return;
+            stroke.pts.push(qx, qy);
             ctx.lineWidth = size;
             ctx.lineCap = "round";
             ctx.strokeStyle = color;
-
-            const rect = canvas.getBoundingClientRect();
-            ctx.lineTo(e.clientX - rect.left, e.clientY - rect.top);
+            ctx.lineTo(x, y);
             ctx.stroke();
             ctx.beginPath();
-            ctx.moveTo(e.clientX - rect.left, e.clientY - rect.top);
+            ctx.moveTo(x, y);
         }
 
         function clearCanvas() {
             ctx.clearRect(0, 0, canvas.width, canvas.height);
+            strokes = [];
         }
 
-        function saveCanvas() {
-            const link = document.createElement('a');
-            link.download = 'drawing.png';
-            link.href = canvas.toDataURL();
-            link.click();
+        // --- компактная запись штрихов (формат описан в боте: «ШТРИХИ -> PNG») ---
+        function varint(out, v) {
+            while (v > 127) { out.push((v & 127) | 128); v = Math.floor(v / 128); }
+            out.push(v);
+        }
+        function zigzag(v) { return v >= 0 ? v * 2 : -v * 2 - 1; }
+        function encodeStrokes() {
+            const out = [];
+            varint(out, canvas.width / Q); varint(out, canvas.height / Q); varint(out, Q);
+            let c = null, w = null;
+            for (const s of strokes) {
+                const n = s.pts.length / 2;
+                if (!n) continue;
+                if (s.c !== c) {
+                    out.push(0, parseInt(s.c.slice(1, 3), 16), parseInt(s.c.slice(3, 5), 16), parseInt(s.c.slice(5, 7), 16));
+                    c = s.c;
+                }
+                if (s.w !== w) { out.push(1, s.w); w = s.w; }
+                out.push(2); varint(out, n); varint(out, Math.max(0, s.pts[0])); varint(out, Math.max(0, s.pts[1]));
+                for (let i = 2; i < s.pts.length; i += 2) {
+                    varint(out, zigzag(s.pts[i] - s.pts[i - 2]));
+                    varint(out, zigzag(s.pts[i + 1] - s.pts[i - 1]));
+                }
+            }
+            return new Uint8Array(out);
+        }
+        async function deflate(bytes) {
+            if (!window.CompressionStream) return null;
+            const stream = new Blob([bytes]).stream().pipeThrough(new CompressionStream("deflate-raw"));
+            return new Uint8Array(await new Response(stream).arrayBuffer());
+        }
+        function base64url(bytes) {
+            let s = "";
+            for (const b of bytes) s += String.fromCharCode(b);
+            return btoa(s).replace(/\\+/g, "-").replace(/\\//g, "_").replace(/=+$/, "");
+        }
+
+        // ссылка от бота несёт подписанный чат — тогда PNG уходит прямо на сервер (POST upload)
+        async function uploadCanvas(tg, params) {
+            const out = document.createElement("canvas");
+            out.width = canvas.width;
+            out.height = canvas.height;
+            const octx = out.getContext("2d");
+            octx.fillStyle = "black";
+            octx.fillRect(0, 0, out.width, out.height);
+            octx.drawImage(canvas, 0, 0);
+            const blob = await new Promise((resolve) => out.toBlob(resolve, "image/png"));
+            const query = new URLSearchParams({
+                c: params.get("c"), s: params.get("s"), title: document.getElementById("title").value,
+            });
+            try {
+                const r = await fetch("upload?" + query, {
+                    method: "POST", body: blob,
+                    headers: {"Content-Type": "image/png", "X-Telegram-Init-Data": tg.initData},
+                });
+                return r.ok;
+            } catch (e) {
+                return false;   // сервер недоступен — отправим штрихами через sendData
+            }
+        }
+
+        async function saveCanvas() {
+            const tg = window.Telegram && Telegram.WebApp;
+            if (!tg || !tg.initData) {
+                // открыто не из Telegram — просто скачиваем картинку
+                const link = document.createElement('a');
+                link.download = 'drawing.png';
+                link.href = canvas.toDataURL();
+                link.click();
+                return;
+            }
+            const params = new URLSearchParams(location.search);
+            if (params.get("s") && await uploadCanvas(tg, params)) {
+                tg.close();
+                return;
+            }
+            const raw = encodeStrokes();
+            const packed = await deflate(raw);
+            const payload = {title: document.getElementById("title").value};
+            if (packed && packed.length < raw.length) {
+                payload.strokes = base64url(packed);
+                payload.z = 1;
+            } else {
+                payload.strokes = base64url(raw);
+            }
+            const text = JSON.stringify(payload);
+            if (new TextEncoder().encode(text).length > LIMIT) {
+                tg.showAlert("Рисунок слишком сложный для отправки — упрости его или нажми «Очистить».");
+                return;
+            }
+            tg.sendData(text);
         }
 
         canvas.addEventListener("mousedown", startPosition);
         canvas.addEventListener("mouseup", endPosition);
+        canvas.addEventListener("mouseleave", endPosition);
         canvas.addEventListener("mousemove", draw);
+        canvas.addEventListener("touchstart", startPosition, {passive: false});
+        canvas.addEventListener("touchend", endPosition);
+        canvas.addEventListener("touchmove", draw, {passive: false});
     </script>
 </body>
 </html>
 """
 
-async def handle_draw(request: web.Request):
-    return web.Response(text=DRAW_HTML, content_type="text/html; charset=utf-8")
+# Рисовалка и её копии (index*.html рядом с ботом) грузятся в память один раз при
+# старте и сразу сжимаются: gzip и, если установлен пакет brotli, br. Отдаём готовые
+# байты с ETag по sha256 содержимого; If-None-Match -> 304. Ссылка в кнопке бота
+# несёт отпечаток (?v=<хэш>) — такой URL неизменяем и кэшируется на год, а голый
+# URL каждый раз перепроверяется по ETag.
+STATIC_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_FILES = ("index.html", "index2.html", "index4.html")
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+class Asset:
+    __slots__ = ("body", "content_type", "hash", "encoded")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        self.hash = hashlib.sha256(body).hexdigest()[:16]
+        self.encoded: Dict[str, bytes] = {}   # content-encoding -> сжатые байты
+        gz = gzip.compress(body, 9, mtime=0)
+        if len(gz) < len(body):
+            self.encoded["gzip"] = gz
+        if brotli is not None:
+            br = brotli.compress(body, quality=11)
+            if len(br) < len(body):
+                self.encoded["br"] = br
+
+assets: Dict[str, Asset] = {}   # путь -> Asset
+
+def load_assets():
+    assets["/draw"] = Asset(DRAW_HTML.encode("utf-8"), "text/html")
+    for name in STATIC_FILES:
+        path = os.path.join(STATIC_DIR, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                assets["/" + name] = Asset(f.read(), "text/html")
+
+def draw_url(chat_id: int | None = None) -> str | None:
+    """URL рисовалки для кнопки. Если страницу отдаём мы — с отпечатком содержимого
+    и с подписанным чатом для прямой загрузки в POST /upload; чужой адрес — как есть:
+    наш отпечаток его содержимое не описывает, а подпись чата третьим лицам ни к чему."""
+    if not DRAW_WEBAPP_URL or not draw_self_hosted():
+        return DRAW_WEBAPP_URL
+    base, _, query = DRAW_WEBAPP_URL.partition("?")
+    params = [query] if query else []
+    asset = assets.get("/" + base.rstrip("/").rsplit("/", 1)[-1]) or assets.get("/draw")
+    if asset is not None:
+        params.append(f"v={asset.hash}")
+    if chat_id is not None:
+        params.append(f"c={chat_id}&s={chat_signature(chat_id)}")
+    return f"{base}?{'&'.join(params)}" if params else base
+
+def draw_self_hosted() -> bool:
+    """DRAW_WEBAPP_URL отдаёт build_web_app? Явно — DRAW_SELF_HOSTED=1/0, иначе по хосту:
+    тот же, что в WEBHOOK_URL, или локальный."""
+    if DRAW_SELF_HOSTED is not None:
+        return DRAW_SELF_HOSTED
+    ours = {"localhost", "127.0.0.1", WEB_HOST}
+    if WEBHOOK_URL:
+        ours.add(urlsplit(WEBHOOK_URL).hostname)
+    return urlsplit(DRAW_WEBAPP_URL).hostname in ours
+
+def pick_encoding(asset: Asset, accept: str) -> str | None:
+    accepted = {part.split(";", 1)[0].strip() for part in accept.lower().split(",")}
+    for enc in ("br", "gzip"):
+        if enc in asset.encoded and enc in accepted:
+            return enc
+    return None
+
+async def handle_asset(request: web.Request):
+    asset = assets[request.path]
+    enc = pick_encoding(asset, request.headers.get("Accept-Encoding", ""))
+    etag = f'"{asset.hash}-{enc}"' if enc else f'"{asset.hash}"'
+    fingerprinted = request.query.get("v") == asset.hash
+    headers = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": f"public, max-age={STATIC_MAX_AGE}, immutable" if fingerprinted else "no-cache",
+    }
+    # содержимое у всех кодировок одно, так что годится любой из наших ETag
+    inm = request.headers.get("If-None-Match", "")
+    if any(tag.strip().removeprefix("W/").strip('"').split("-", 1)[0] == asset.hash
+           for tag in inm.split(",")):
+        return web.Response(status=304, headers=headers)
+    if enc:
+        headers["Content-Encoding"] = enc
+    body = asset.encoded.get(enc, asset.body) if enc else asset.body
+    return web.Response(body=body, content_type=asset.content_type, charset="utf-8", headers=headers)
+
+# ====== ЗАГРУЗКА РИСУНКА НАПРЯМУЮ (POST /upload) ======
+# Страница рисовалки, открытая по ссылке бота, шлёт PNG холста прямо сюда:
+# тело — сами байты картинки, initData — в заголовке X-Telegram-Init-Data,
+# чат — в параметрах c и s (s — подпись чата, её ставит бот в draw_url).
+# Тело читается кусками в буфер с пределом, без base64 и json.loads.
+def chat_signature(chat_id: int) -> str:
+    key = hashlib.sha256(f"draw:{API_TOKEN}".encode()).digest()
+    return hmac.new(key, str(chat_id).encode(), hashlib.sha256).hexdigest()[:32]
+
+def upload_error(status: int, error: str) -> web.Response:
+    return web.json_response({"ok": False, "error": error}, status=status)
+
+async def handle_upload(request: web.Request) -> web.Response:
+    try:
+        init = safe_parse_webapp_init_data(API_TOKEN, request.headers.get("X-Telegram-Init-Data", ""))
+    except ValueError:
+        return upload_error(403, "bad initData")
+    if init.user is None or time.time() - init.auth_date.timestamp() > INIT_DATA_MAX_AGE:
+        return upload_error(403, "stale initData")
+    try:
+        chat_id = int(request.query["c"])
+    except (KeyError, ValueError):
+        return upload_error(400, "no chat")
+    if not hmac.compare_digest(request.query.get("s", ""), chat_signature(chat_id)):
+        return upload_error(403, "bad chat signature")
+    if (request.content_length or 0) > UPLOAD_MAX_BYTES:
+        return upload_error(413, "too large")
+
+    buf = bytearray()
+    async for chunk in request.content.iter_chunked(64 * 1024):
+        buf += chunk
+        if len(buf) > UPLOAD_MAX_BYTES:
+            return upload_error(413, "too large")
+    if not buf.startswith(b"\x89PNG\r\n\x1a\n"):
+        return upload_error(415, "png expected")
+
+    g = get_game(chat_id)
+    u = init.user
+    p = ensure_player(g, types.User(id=u.id, is_bot=False, first_name=u.first_name,
+                                    last_name=u.last_name, username=u.username))
+    if p.arts_created + p.arts_pending >= MAX_ARTS_PER_PLAYER:
+        return upload_error(409, "already has 2 arts")
+    try:
+        queue_drawing(g, p, request.query.get("title", "").strip(), bytes(buf), "raw")
+    except asyncio.QueueFull:
+        return upload_error(503, "busy")
+    return web.json_response({"ok": True}, status=202)
+
+async def handle_metrics(request: web.Request):
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+# ====== ОТЛАДКА ======
+# Только с DEBUG_TOKEN в заголовке Authorization: Bearer <токен>, иначе 404. В строке запроса
+# токен не принимаем: она оседает в логах доступа, прокси и истории браузера.
+#   GET  /debug/traces?chat=<id>[&limit=N]  — последние трассы чата (см. ТРАССИРОВКА), JSON
+#   POST /debug/profile?seconds=5&mode=cprofile[&sort=cumulative&limit=40]
+#        — cProfile живого цикла событий на seconds секунд, текст pstats;
+#        mode=sample — сэмплер стеков потока цикла раз в interval_ms, схлопнутые стеки
+#        «a;b;c count» (для flamegraph.pl / speedscope). Один замер за раз.
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+PROFILE_MAX_SEC = 60
+profile_lock = asyncio.Lock()
+
+def debug_allowed(request: web.Request) -> bool:
+    if not DEBUG_TOKEN:
+        return False
+    auth = request.headers.get("Authorization", "")
+    if not auth.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(auth[7:].encode(), DEBUG_TOKEN.encode())
+
+async def handle_traces(request: web.Request) -> web.Response:
+    if not debug_allowed(request):
+        raise web.HTTPNotFound()
+    try:
+        chat_id = int(request.query["chat"])
+        limit = int(request.query.get("limit", TRACE_PER_CHAT))
+    except (KeyError, ValueError):
+        return web.json_response({"ok": False, "error": "chat expected"}, status=400)
+    ring = list(traces.get(chat_id, ()))
+    return web.json_response([t.to_dict() for t in ring[-limit:]], dumps=json_dumps)
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> collections.Counter:
+    """Снимать стек потока thread_id раз в interval секунд; счётчик схлопнутых стеков."""
+    stacks: collections.Counter = collections.Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        stacks[";".join(reversed(names))] += 1
+        time.sleep(interval)
+    return stacks
+
+async def handle_profile(request: web.Request) -> web.Response:
+    if not debug_allowed(request):
+        raise web.HTTPNotFound()
+    if profile_lock.locked():
+        return web.Response(status=409, text="profile already running\n")
+    q = request.query
+    try:
+        seconds = min(PROFILE_MAX_SEC, max(0.1, float(q.get("seconds", "5"))))
+        limit = int(q.get("limit", "40"))
+        interval = max(0.001, float(q.get("interval_ms", "5")) / 1000)
+    except ValueError:
+        return web.Response(status=400, text="bad parameters\n")
+    async with profile_lock:
+        if q.get("mode", "cprofile") == "sample":
+            stacks = await asyncio.to_thread(sample_stacks, threading.get_ident(), seconds, interval)
+            text = "".join(f"{stack} {n}\n" for stack, n in stacks.most_common(limit))
+        else:
+            prof = cProfile.Profile()
+            prof.enable()   # профилирует поток цикла — всё, что он выполнит за окно
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                prof.disable()
+            out = StringIO()
+            try:
+                pstats.Stats(prof, stream=out).sort_stats(q.get("sort", "cumulative")).print_stats(limit)
+            except KeyError:
+                return web.Response(status=400, text="bad sort key\n")
+            text = out.getvalue()
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
 
-async def run_web_server():
+def build_web_app() -> web.Application:
     app = web.Application()
-    app.router.add_get("/draw", handle_draw)
-    runner = web.AppRunner(app)
+    load_assets()
+    for path in assets:
+        app.router.add_get(path, handle_asset)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/debug/traces", handle_traces)
+    app.router.add_post("/debug/profile", handle_profile)
+    app.router.add_post(UPLOAD_PATH, shard_router.handle_upload if SHARDS > 1 and SHARD_INDEX is None
+                        else handle_upload)
+    if SHARD_INDEX is not None:
+        app.router.add_post(SHARD_PATH, handle_shard_batch)
+    elif BOT_MODE == "webhook":
+        # апдейт подтверждаем, как только он встал в очередь чата — Telegram не ждёт игру
+        app.router.add_post(WEBHOOK_PATH, handle_webhook)
+    return app
+
+async def run_web_server() -> web.AppRunner:
+    runner = web.AppRunner(build_web_app())
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", 8080)
+    site = web.TCPSite(runner, WEB_HOST, WEB_PORT)
     await site.start()
     log.info("WebApp served at https://azatbro2.github.io/azat/  (используй ngrok для HTTPS)")
+    return runner
+
+async def run_webhook():
+    if not WEBHOOK_URL:
+        raise SystemExit("BOT_MODE=webhook требует WEBHOOK_URL")
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    log.info("webhook mode: %s%s", WEBHOOK_URL.rstrip("/"), WEBHOOK_PATH)
+    await asyncio.Event().wait()
+
+# ====== ПРИЁМ АПДЕЙТОВ ======
+# Апдейты берём сырым JSON (свой long polling или вебхук) и кладём в update_queue —
+# тот же ChatExecutor с ключом chat_id: апдейты одного чата обрабатываются строго по
+# порядку (вторая ставка не начнётся, пока не отработала первая), разные чаты — параллельно,
+# не больше UPDATE_WORKERS одновременно. Переполнение здесь не отбрасываем: приём ждёт
+# места, а непрочитанное остаётся у Telegram до следующего getUpdates.
+def update_chat_id(update: dict) -> int:
+    """chat_id апдейта без разбора в модели: чат сообщения, иначе отправитель."""
+    for key, payload in update.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+update_queue = ChatExecutor(UPDATE_WORKERS, UPDATE_QUEUE_MAX, name="update")
+
+async def accept_update(update: dict):
+    if SHARDS > 1 and SHARD_INDEX is None:
+        await shard_router.route(update)   # фронт: дальше разбирается воркер-владелец чата
+        return
+    received = time.perf_counter()
+    await update_queue.wait_room()
+    chat_id = update_chat_id(update)
+    update_queue.submit(chat_id, feed_update, chat_id, update, received)
+
+async def feed_update(chat_id: int, update: dict, received: float):
+    kind = next((k for k in update if k != "update_id"), "?")
+    tr = begin_trace(chat_id, kind, update.get("update_id"), received)
+    if tr is not None:
+        tr.cursor = time.perf_counter()
+        tr.span("queue", received, tr.cursor)
+    token = current_trace.set(tr)
+    try:
+        await dp.feed_raw_update(bot, update)
+    finally:
+        current_trace.reset(token)
+
+async def poll_updates():
+    """Long polling сырым JSON; UPDATES_LIMIT/UPDATES_TIMEOUT задают размер пачки и ожидание.
+    Ходит через aiohttp-сессию бота — тот же PROXY_URL и SSL-контекст, что у ответов."""
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    params = {"limit": UPDATES_LIMIT, "timeout": UPDATES_TIMEOUT,
+              "allowed_updates": dp.resolve_used_update_types()}
+    headers = {"Content-Type": "application/json"}
+    offset = 0
+    while True:
+        try:
+            http = await bot.session.create_session()
+            async with http.post(url, data=json_dumps({**params, "offset": offset}), headers=headers) as r:
+                data = await r.json(loads=json_loads, content_type=None)
+        except (ClientError, asyncio.TimeoutError, ValueError) as e:
+            log.warning("getUpdates failed: %r", e)
+            await asyncio.sleep(1)
+            continue
+        if not data.get("ok"):
+            retry = (data.get("parameters") or {}).get("retry_after", 1)
+            log.warning("getUpdates: %s", data.get("description"))
+            await asyncio.sleep(retry)
+            continue
+        for update in data["result"]:
+            offset = update["update_id"] + 1
+            await accept_update(update)
+
+def secret_ok(request: web.Request) -> bool:
+    got = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    return hmac.compare_digest(got.encode(), WEBHOOK_SECRET.encode())
+
+async def handle_webhook(request: web.Request) -> web.Response:
+    if not secret_ok(request):
+        return web.Response(status=401)
+    await accept_update(await request.json(loads=json_loads))
+    return web.Response()
+
+# ====== ШАРДИРОВАНИЕ ПО ПРОЦЕССАМ ======
+# SHARDS=N: этот процесс становится фронтом. Он не разбирает апдейты в pydantic —
+# по chat_id выбирает воркер и пачками пересылает на его SHARD_PATH. Воркеры — тот же
+# файл с SHARD_INDEX; каждый владеет партиями своих чатов (один писатель на чат),
+# своим журналом и сам ходит в Bot API.
+class ShardRouter:
+    def __init__(self, shards: int):
+        self.shards = shards
+        self.queues: List[asyncio.Queue] = []
+        self.procs: List[subprocess.Popen | None] = [None] * shards
+        self.http: ClientSession | None = None
+        self._tasks: List[asyncio.Task] = []
+        self.routed = 0
+
+    async def start(self):
+        self.http = ClientSession()
+        self.queues = [asyncio.Queue(SHARD_QUEUE_MAX) for _ in range(self.shards)]
+        loop = asyncio.get_running_loop()
+        for i in range(self.shards):
+            self.procs[i] = self._spawn(i)
+            self._tasks.append(loop.create_task(self._forward(i)))
+        self._tasks.append(loop.create_task(self._supervise()))
+
+    def _spawn(self, i: int) -> subprocess.Popen:
+        env = dict(os.environ)
+        env.update({
+            "SHARD_INDEX": str(i),
+            "WEB_HOST": "127.0.0.1",
+            "WEB_PORT": str(SHARD_BASE_PORT + i),
+            "WEBHOOK_SECRET": WEBHOOK_SECRET,
+            "JOURNAL_DIR": os.path.join(JOURNAL_DIR, f"shard-{i}"),
+            # у каждого воркера свой файл: RotatingFileHandler'ы разных процессов на одном
+            # пути ротировали бы его наперегонки и теряли записи
+            "EVENT_LOG": EVENT_LOG and os.path.join(os.path.dirname(EVENT_LOG), f"shard-{i}",
+                                                    os.path.basename(EVENT_LOG)),
+        })
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+    async def _supervise(self):
+        # упавший воркер перезапускаем: партии его чатов поднимутся из его журнала
+        while True:
+            await asyncio.sleep(1)
+            for i, proc in enumerate(self.procs):
+                if proc is not None and proc.poll() is not None:
+                    log.warning("shard %d exited with %s, restarting", i, proc.returncode)
+                    self.procs[i] = self._spawn(i)
+
+    def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        for proc in self.procs:
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+        for proc in self.procs:
+            if proc is not None:
+                with contextlib.suppress(subprocess.TimeoutExpired):
+                    proc.wait(10)
+
+    async def route(self, update: dict):
+        """В очередь воркера; она полна (воркер лежит или не успевает) — ждём, и приём
+        апдейтов встаёт вместе с нами: непрочитанное остаётся у Telegram, а не в памяти фронта."""
+        await self.queues[update_chat_id(update) % self.shards].put(update)
+        self.routed += 1
+
+    async def _forward(self, i: int):
+        """Один пересыльщик на воркер: пачки уходят по очереди, порядок апдейтов чата сохраняется."""
+        q = self.queues[i]
+        url = f"http://127.0.0.1:{SHARD_BASE_PORT + i}{SHARD_PATH}"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+        while True:
+            batch = [await q.get()]
+            while not q.empty() and len(batch) < SHARD_BATCH_MAX:
+                batch.append(q.get_nowait())
+            delay = 0.2
+            while True:
+                try:
+                    async with self.http.post(url, json=batch, headers=headers) as r:
+                        status = r.status
+                except ClientError:
+                    status = None  # воркер ещё стартует или перезапускается
+                if status == 200:
+                    break
+                if status is not None and 400 <= status < 500 and status not in (408, 429):
+                    # повтор не поможет (чужой секрет, битая пачка) — не держим очередь воркера
+                    log.error("shard %d rejected a batch with %s, dropped %d updates", i, status, len(batch))
+                    break
+                if status is not None:
+                    log.warning("shard %d answered %s, retrying in %.1fs", i, status, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    async def handle_upload(self, request: web.Request) -> web.Response:
+        """POST /upload во фронте: тело потоком уходит воркеру, владеющему чатом."""
+        try:
+            chat_id = int(request.query["c"])
+        except (KeyError, ValueError):
+            return upload_error(400, "no chat")
+        if (request.content_length or 0) > UPLOAD_MAX_BYTES:
+            return upload_error(413, "too large")
+        url = f"http://127.0.0.1:{SHARD_BASE_PORT + chat_id % self.shards}{request.path_qs}"
+        headers = {k: request.headers[k] for k in ("X-Telegram-Init-Data", "Content-Type") if k in request.headers}
+        try:
+            async with self.http.post(url, data=request.content, headers=headers) as r:
+                return web.Response(status=r.status, body=await r.read(), content_type=r.content_type)
+        except ClientError:
+            return upload_error(503, "shard unavailable")
+
+shard_router = ShardRouter(SHARDS)
+
+async def handle_shard_batch(request: web.Request) -> web.Response:
+    """Воркер: пачка сырых апдейтов от фронта. Ставим их в очередь по порядку и отвечаем."""
+    if not secret_ok(request):
+        return web.Response(status=401)
+    for update in await request.json(loads=json_loads):
+        await accept_update(update)
+    return web.Response()
+
+async def run_front():
+    await shard_router.start()
+    runner = await run_web_server()
+    log.info("front: %d shards on ports %d..%d", SHARDS, SHARD_BASE_PORT, SHARD_BASE_PORT + SHARDS - 1)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await poll_updates()
+    finally:
+        shard_router.stop()
+        await shard_router.http.close()
+        await runner.cleanup()
 
 # ====== ЗАПУСК ======
 async def main():
+    # по SIGTERM/SIGINT останавливаемся штатно: снапшот, журнал, воркеры
+    task = asyncio.current_task()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            asyncio.get_running_loop().add_signal_handler(sig, task.cancel)
+    if SHARDS > 1 and SHARD_INDEX is None:
+        await run_front()          # фронт только раскладывает апдейты по воркерам
+        return
+    n = restore_games()            # поднимем партии, прерванные падением
+    if n:
+        log.info("restored %d games from %s", n, JOURNAL_DIR)
+    journal.start()
+    event_log.start()
     await run_web_server()         # поднимем рисовалку
-    await dp.start_polling(bot)    # запустим бота (long polling)
+    asyncio.create_task(evictor_loop())  # чистка простаивающих партий
+    asyncio.create_task(snapshot_loop())
+    try:
+        if SHARD_INDEX is not None:
+            await asyncio.Event().wait()   # апдейты присылает фронт
+        elif BOT_MODE == "webhook":
+            await run_webhook()        # апдейты приходят на тот же aiohttp-сервер
+        else:
+            await poll_updates()       # запустим бота (long polling)
+    finally:
+        snapshot_games()
+        journal.close()
+        event_log.close()
+        await bot.session.close()
 
 if __name__ == "__main__":
-    import contextlib
     try:
         asyncio.run(main())
-    except (KeyboardInterrupt, SystemExit):
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
         print("stopped")
+    finally:
+        log_listener.stop()   # допечатать очередь логов
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Разбор журнала событий бота (EVENT_LOG, по умолчанию data/events.jsonl + ротированные .gz).
+
+Печатает ход партий чата: лоты, ставки (с отказами и остатком таймера), пассы, продажи —
+и заново считает итоговый капитал по правилам auction_rules.py, сверяя его с записанными
+итогами. Годится для споров «я ставил раньше» и для проверки, что журнал полный.
+
+  python auction_log.py -100123456                   # все партии чата
+  python auction_log.py -100123456 --log shard-0/events.jsonl --quiet
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+from datetime import datetime
+
+from auction_rules import BID_OK, Ledger, Lot, Player, take_loan
+
+REJECTS = {1: "author", 2: "no money", 3: "too low"}
+
+def log_files(path: str) -> list:
+    """Файлы журнала от старых к новым: events.jsonl.N.gz ... events.jsonl.1.gz, events.jsonl."""
+    rotated = glob.glob(glob.escape(path) + ".*.gz")
+    rotated.sort(key=lambda p: int(re.search(r"\.(\d+)\.gz$", p).group(1)), reverse=True)
+    return rotated + ([path] if os.path.exists(path) else [])
+
+def read_events(path: str, chat_id: int):
+    for name in log_files(path):
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(name, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue   # недописанная строка при падении
+                if ev.get("c") == chat_id:
+                    yield ev
+
+class Replay:
+    """Партия, собранная из событий журнала."""
+
+    def __init__(self):
+        self.players: dict = {}
+        self.names: dict = {}
+        self.ledger = Ledger()
+
+    def apply(self, ev: dict):
+        kind = ev["e"]
+        if kind == "join":
+            self.players[ev["u"]] = Player(ev["u"], ev["name"], None)
+        elif kind == "loan":
+            take_loan(self.players[ev["u"]])
+        elif kind == "lot":
+            self.ledger.add(Lot(ev["l"], ev["u"], ev.get("title", ""), "", ev["real"], ev["p"]))
+        elif kind == "sale":
+            lot = self.ledger.by_id[ev["l"]]
+            buyer = self.players[ev["u"]] if ev["p"] else None
+            self.ledger.settle(lot, buyer, ev["u"], ev["p"])
+
+    def check(self, rank: list) -> list:
+        """Расхождения пересчитанного капитала с записанными итогами."""
+        problems = []
+        for uid, cap in rank:
+            p = self.players.get(uid)
+            if p is None:
+                problems.append(f"player {uid} has no join event")
+            elif self.ledger.capital(p) != cap:
+                problems.append(f"player {uid}: logged capital {cap}, replayed {self.ledger.capital(p)}")
+        return problems
+
+def describe(ev: dict, names: dict) -> str:
+    who = names.get(ev.get("u"), ev.get("u"))
+    left = f" ({ev['left']:.2f}s left)" if ev.get("left") is not None else ""
+    kind = ev["e"]
+    if kind == "bid":
+        verdict = "" if ev["r"] == BID_OK else f" REJECTED: {REJECTS.get(ev['r'], ev['r'])}"
+        return f"lot {ev['l']}: {who} bids {ev['p']}{left}{verdict}"
+    if kind == "pass":
+        return f"lot {ev['l']}: {who} passes{left}"
+    if kind == "sale":
+        if not ev["p"]:
+            return f"lot {ev['l']}: kept by author {who} (real {ev['real']})"
+        return f"lot {ev['l']}: SOLD to {who} for {ev['p']} (real {ev['real']}){left}"
+    if kind == "open":
+        return f"lot {ev['l']}: open at {ev['p']}, bidders {[names.get(u, u) for u in ev['active']]}"
+    if kind == "lot":
+        return f"lot {ev['l']}: added by {who}, start {ev['p']}, real {ev['real']}"
+    if kind == "tick":
+        return f"lot {ev['l']}: timer {ev['left']:.1f}s"
+    if kind == "result":
+        return "result: " + ", ".join(f"{names.get(u, u)}={cap}" for u, cap in ev["rank"])
+    return f"{kind}: {who}" if ev.get("u") is not None else kind
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("chat_id", type=int)
+    ap.add_argument("--log", default=os.path.join(os.getenv("JOURNAL_DIR", "data"), "events.jsonl"))
+    ap.add_argument("--quiet", action="store_true", help="только сверка итогов")
+    args = ap.parse_args()
+
+    game, games, bad = Replay(), 0, 0
+    for ev in read_events(args.log, args.chat_id):
+        if ev["e"] == "reset":
+            game = Replay()
+        game.apply(ev)
+        if ev["e"] == "join":
+            game.names[ev["u"]] = ev["name"]
+        if not args.quiet:
+            stamp = datetime.fromtimestamp(ev["t"]).strftime("%H:%M:%S.%f")[:-3]
+            print(f"{stamp}  {describe(ev, game.names)}")
+        if ev["e"] == "result":
+            games += 1
+            problems = game.check(ev["rank"])
+            bad += bool(problems)
+            for problem in problems:
+                print(f"  MISMATCH {problem}")
+    print(f"{games} finished game(s) in chat {args.chat_id}, {bad} with mismatches")
+    sys.exit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Правила аукциона без ввода-вывода: экономика, цены лотов, ставки, пассы, учёт и капитал.
+
+Общий код для бота («What is your name.py») и офлайн-симулятора (simulate.py):
+балансируя экономику в симуляторе, меняем ровно то, по чему играет живой бот.
+Здесь нет Telegram, asyncio, журнала и часов — только состояние и решения.
+
+Функции торгов работают с любым объектом, у которого есть поля lot, active_ids,
+price, leader и passed (партия бота Game, торги симулятора Bidding).
+"""
+
+import random
+from collections import deque
+from typing import Dict, List
+
+# ====== ЭКОНОМИКА ======
+START_MONEY = 3000
+LOAN_PLUS = 1000
+LOAN_PAYBACK = 1500
+
+MAX_ARTS_PER_PLAYER = 2
+
+# реальная стоимость лота
+REAL_MIN = 100
+REAL_MAX = 3500
+# стартовая цена должна быть ниже реальной
+START_OFFSETS = [100, 200, 300]  # насколько ниже реальной
+# шаги ставок на кнопках лота
+BID_STEPS = (100, 200, 300)
+
+# ====== ИГРОКИ И ЛОТЫ ======
+class Player:
+    __slots__ = ("id", "name", "username", "money", "loan", "arts_created", "arts_pending")
+
+    def __init__(self, uid: int, name: str, username: str | None):
+        self.id = uid
+        self.name = name
+        self.username = username
+        self.money = START_MONEY
+        self.loan = False
+        self.arts_created = 0  # сколько картин добавил (макс 2)
+        self.arts_pending = 0  # рисунков ещё в загрузке
+
+class Lot:
+    __slots__ = ("id", "author_id", "title", "file_id", "real_value", "start_price", "sold_to", "sold_price")
+
+    def __init__(self, lot_id: int, author_id: int, title: str, file_id: str, real_value: int, start_price: int):
+        self.id = lot_id
+        self.author_id = author_id
+        self.title = title
+        self.file_id = file_id
+        self.real_value = real_value
+        self.start_price = start_price
+        self.sold_to: int | None = None
+        self.sold_price: int = 0
+
+class Ledger:
+    """Учёт партии: лоты по id, очередь торгов, кто чем владеет и бегущие итоги.
+    Итоги обновляются в settle(), поэтому капитал игрока считается за O(1)."""
+    __slots__ = ("lots", "by_id", "queue", "holdings", "value")
+
+    def __init__(self):
+        self.lots: List[Lot] = []                  # все лоты в порядке добавления
+        self.by_id: Dict[int, Lot] = {}            # lot_id -> Lot
+        self.queue: deque = deque()                # очередь id лотов на торги
+        self.holdings: Dict[int, List[int]] = {}   # user_id -> id купленных лотов
+        self.value: Dict[int, int] = {}            # user_id -> сумма реальных цен купленного
+
+    def next_id(self) -> int:
+        return len(self.lots) + 1
+
+    def add(self, lot: Lot):
+        self.lots.append(lot)
+        self.by_id[lot.id] = lot
+
+    def shuffle_queue(self, rng: random.Random = random):
+        ids = [l.id for l in self.lots]
+        rng.shuffle(ids)
+        self.queue = deque(ids)
+
+    def pop_next(self) -> Lot | None:
+        return self.by_id[self.queue.popleft()] if self.queue else None
+
+    def settle(self, lot: Lot, owner: Player | None, owner_id: int, price: int = 0):
+        """Лот ушёл owner_id за price (0 — остался у автора)."""
+        lot.sold_to = owner_id
+        lot.sold_price = price
+        if owner is not None:
+            owner.money -= price
+        self.holdings.setdefault(owner_id, []).append(lot.id)
+        self.value[owner_id] = self.value.get(owner_id, 0) + lot.real_value
+
+    def owned(self, uid: int) -> List[int]:
+        return self.holdings.get(uid, [])
+
+    def capital(self, p: Player) -> int:
+        cap = p.money + self.value.get(p.id, 0)
+        if p.loan:
+            cap -= LOAN_PAYBACK
+        return cap
+
+    def ranking(self, players) -> list:
+        """[(капитал, игрок, сумма картин)] по убыванию капитала."""
+        rating = [(self.capital(p), p, self.value.get(p.id, 0)) for p in players]
+        rating.sort(key=lambda x: x[0], reverse=True)
+        return rating
+
+def round10(x: int) -> int:
+    """Округление вниз до десятки: 234 -> 230."""
+    return (x // 10) * 10
+
+def price_lot(rng: random.Random = random) -> tuple:
+    """(реальная стоимость, стартовая цена) нового лота; стартовая ниже реальной."""
+    real = round10(rng.randint(REAL_MIN, REAL_MAX))
+    start = max(REAL_MIN, real - rng.choice(START_OFFSETS))
+    if start >= real:
+        start = max(REAL_MIN, real - 100)
+    return real, round10(start)
+
+def take_loan(p: Player) -> bool:
+    """Выдать кредит (один на игрока). False — уже брал."""
+    if p.loan:
+        return False
+    p.loan = True
+    p.money += LOAN_PLUS
+    return True
+
+# ====== ТОРГИ ======
+BID_OK, BID_AUTHOR, BID_NO_MONEY, BID_TOO_LOW = range(4)
+# итог пасса: не участник, торги идут дальше, продать лидеру, оставить автору
+PASS_IGNORED, PASS_OPEN, PASS_SOLD, PASS_KEPT = range(4)
+
+def open_lot(t, lot: Lot, players: Dict[int, Player]) -> bool:
+    """Начать торги лота: ставить могут все, кроме автора. False — покупателей нет,
+    торги не тронуты (лот остаётся у автора)."""
+    active_ids = [pid for pid in players if pid != lot.author_id]
+    if not active_ids:
+        return False
+    t.lot = lot
+    t.active_ids = active_ids
+    t.price = lot.start_price
+    t.leader = None
+    t.passed = set()
+    return True
+
+def place_bid(t, players: Dict[int, Player], uid: int, new_price: int) -> int:
+    """Ставка uid на new_price: BID_OK (цена и лидер обновлены) или причина отказа."""
+    if uid not in t.active_ids:
+        return BID_AUTHOR
+    # цены всегда «круглые»
+    new_price = round10(new_price)
+    if players[uid].money < new_price:
+        return BID_NO_MONEY
+    if new_price <= t.price:
+        return BID_TOO_LOW
+    t.price = new_price
+    t.leader = uid
+    t.passed.clear()  # все «Пассы» обнуляем
+    return BID_OK
+
+def place_pass(t, uid: int) -> int:
+    """Пасс uid и что из него следует для лота."""
+    # учитывать только участников (не автора)
+    if uid not in t.active_ids:
+        return PASS_IGNORED
+    t.passed.add(uid)
+    # если есть лидер и ВСЕ КРОМЕ НЕГО пассанули — продаём сразу
+    if t.leader is not None:
+        others = set(t.active_ids) - {t.leader}
+        if others.issubset(t.passed) and others:
+            return PASS_SOLD
+    # если никто не ставил и все пассанули — лот к автору
+    elif set(t.active_ids).issubset(t.passed):
+        return PASS_KEPT
+    return PASS_OPEN
+
+def deadline_outcome(t) -> int:
+    """Время лота вышло: продаём лидеру или оставляем у автора."""
+    return PASS_SOLD if t.leader is not None else PASS_KEPT
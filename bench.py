@@ -0,0 +1,613 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарки горячих путей бота без сети.
+
+Бот грузится из «What is your name.py», вместо Bot подставляется FakeBot,
+который только записывает вызовы (с искусственной задержкой сети),
+а апдейты — синтетические.
+
+  python bench.py                       # всё по умолчанию
+  python bench.py --players 20 --waves 30 --latency 0.08
+  python bench.py --chats 200 --per-chat 10    # диспетчеризация апдейтов
+  python bench.py --suite                       # обработчики по одному -> bench_output.txt
+  python bench.py --suite --sizes 10x100 --max-bid-us 150 --journals
+"""
+
+import argparse
+import asyncio
+import base64
+import gc
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from collections import Counter
+from types import SimpleNamespace
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "What is your name.py")
+
+def load_bot():
+    """Импортировать модуль бота (имя файла с пробелами — через importlib)."""
+    os.environ.setdefault("API_TOKEN", "123456:bench")
+    os.environ.setdefault("DRAW_WEBAPP_URL", "https://example.invalid/draw")
+    mod = sys.modules.get("auction_bot")
+    if mod is None:
+        spec = importlib.util.spec_from_file_location("auction_bot", BOT_FILE)
+        mod = importlib.util.module_from_spec(spec)
+        sys.modules["auction_bot"] = mod
+        spec.loader.exec_module(mod)
+    return mod
+
+class FakeBot:
+    """Записывает вызовы Bot API и отвечает правдоподобными заглушками."""
+
+    id = 123456
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: list = []
+        self._mid = 1000
+
+    def __getattr__(self, method):
+        async def call(*args, **kwargs):
+            self.calls.append(method)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            self._mid += 1
+            return SimpleNamespace(message_id=self._mid,
+                                   photo=[SimpleNamespace(file_id=f"file{self._mid}")])
+        return call
+
+    async def __call__(self, method, request_timeout=None):
+        """Шорткаты моделей aiogram (m.answer, c.answer) зовут bot(method)."""
+        return await getattr(self, type(method).__name__)()
+
+    def count(self, method: str) -> int:
+        return sum(1 for m in self.calls if m == method)
+
+class FakeCallback:
+    """Минимальный CallbackQuery: on_bid/on_pass трогают только эти поля."""
+
+    def __init__(self, chat_id: int, uid: int, data: str, latency: float = 0.0):
+        self.id = f"{chat_id}:{uid}:{data}:{time.perf_counter_ns()}"
+        self.data = data
+        self.from_user = SimpleNamespace(id=uid)
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=chat_id))
+        self.latency = latency
+        self.t0 = 0.0
+        self.acked_at = None      # ответ ушёл (запрос answerCallbackQuery начат)
+        self.done_at = None       # обработчик апдейта освободился
+
+    async def answer(self, text=None, show_alert=False, **kwargs):
+        if self.acked_at is None:
+            self.acked_at = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+def install_fake_bot(mod, latency: float = 0.0) -> FakeBot:
+    fb = FakeBot(latency)
+    mod.bot = fb
+    mod.outbox.bot = fb
+    return fb
+
+def make_game(mod, chat_id: int, n_players: int, lots_per_player: int = 2, money: int = 10 ** 9):
+    g = mod.get_game(chat_id)
+    for uid in range(1, n_players + 1):
+        p = mod.Player(uid, f"p{uid}", None)
+        p.money = money
+        g.players[uid] = p
+        for _ in range(lots_per_player):
+            lot_id = g.ledger.next_id()
+            g.ledger.add(mod.Lot(lot_id, uid, f"Картина #{lot_id}", f"file{lot_id}", 1000, 800))
+    return g
+
+async def wait_bidding(mod, g) -> bool:
+    """Дождаться, пока автомат откроет лот (фото отправлено). False — партия закончилась."""
+    while g.phase != mod.PHASE_BIDDING:
+        if g.finished:
+            return False
+        await asyncio.sleep(0.001)
+    return True
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def bench_bid_burst(mod, players: int, waves: int, latency: float):
+    """Волны одновременных кликов по «+100/+200/+300» на один лот; меряем задержку ack."""
+    fb = install_fake_bot(mod, latency)
+    g = make_game(mod, chat_id=-1001, n_players=players)
+    mod.post_event(g, mod.EV_START)
+    await wait_bidding(mod, g)
+    bidders = list(g.active_ids)
+    fb.calls.clear()
+
+    lat = []
+    held = []
+    accepted = 0
+    for _ in range(waves):
+        base = g.price
+        cbs = [FakeCallback(g.chat_id, uid, f"bid:{base + 100 * (1 + i % 3)}", latency)
+               for i, uid in enumerate(bidders)]
+        prices_before = g.price
+
+        async def click(cb):
+            cb.t0 = time.perf_counter()
+            await mod.on_bid(cb)
+            cb.done_at = time.perf_counter()
+
+        await asyncio.gather(*(click(cb) for cb in cbs))
+        while any(cb.acked_at is None for cb in cbs):
+            await asyncio.sleep(0)
+        lat.extend(cb.acked_at - cb.t0 for cb in cbs)
+        held.extend(cb.done_at - cb.t0 for cb in cbs)
+        accepted += g.price != prices_before
+        await asyncio.sleep(0.05)  # пауза между волнами, как у живых людей
+
+    await asyncio.sleep(mod.CAPTION_DEBOUNCE_SEC + latency * 4 + 0.2)
+    clicks = len(lat)
+    print(f"bid burst: players={players} waves={waves} api_latency={latency * 1000:.0f}ms")
+    print(f"  clicks={clicks} waves_with_accepted_bid={accepted} final_price={g.price}")
+    print(f"  ack latency: p50={percentile(lat, 0.5) * 1e6:.0f}us "
+          f"p99={percentile(lat, 0.99) * 1e6:.0f}us max={max(lat) * 1e6:.0f}us")
+    print(f"  update handler busy: p50={percentile(held, 0.5) * 1e6:.0f}us "
+          f"p99={percentile(held, 0.99) * 1e6:.0f}us")
+    print(f"  caption edits sent={fb.count('edit_message_caption')}")
+    mod.drop_game(g.chat_id)
+
+async def bench_lot_transitions(mod, players: int, latency: float, limits: bool = False):
+    """Вся партия, где на каждом лоте все сразу жмут «Пасс»: время на смену лота.
+    Без --telegram-limits это только наш код и задержка API; с лимитами смену лота
+    задаёт OUT_CHAT_RATE (подпись продажи и фото следующего лота — два сообщения в чат)."""
+    fb = install_fake_bot(mod, latency)
+    g = make_game(mod, chat_id=-1002, n_players=players)
+    t0 = time.perf_counter()
+    mod.post_event(g, mod.EV_START)
+    lots = 0
+    while await wait_bidding(mod, g):
+        lot = g.lot
+        lots += 1
+        for uid in list(g.active_ids):
+            if g.lot is not lot:
+                break
+            await mod.on_pass(FakeCallback(g.chat_id, uid, "pass"))
+    dt = time.perf_counter() - t0
+    print(f"lot transitions: players={players} lots={lots} api_latency={latency * 1000:.0f}ms "
+          f"outbox limits={'telegram' if limits else 'off'}")
+    print(f"  game wall time={dt:.2f}s per lot={dt / max(lots, 1) * 1000:.0f}ms "
+          f"api calls={len(fb.calls)}")
+    mod.drop_game(g.chat_id)
+
+async def bench_dispatch(mod, chats: int, per_chat: int, latency: float):
+    """Сырые апдейты вперемешку из многих чатов через Dispatcher тремя способами:
+    задача на апдейт (как dp.start_polling), строго по одному и update_queue бота.
+    В каждом чате ставки растут, так что при сохранённом порядке принимаются все;
+    каждый пятый апдейт — /status (ответ уходит через outbox)."""
+    from fake_botapi import FakeBotAPI
+
+    install_fake_bot(mod, latency)
+    api = FakeBotAPI()
+    accepted = 0
+    apply_bid = mod.EVENT_HANDLERS[mod.EV_BID]
+
+    def counting_bid(g, uid, price):
+        nonlocal accepted
+        res = apply_bid(g, uid, price)
+        accepted += g.leader == uid and g.price == mod.round10(price)
+        return res
+    mod.EVENT_HANDLERS[mod.EV_BID] = counting_bid
+
+    async def serial(batch):
+        for u in batch:
+            await mod.dp.feed_raw_update(mod.bot, u)
+
+    async def tasks(batch):
+        await asyncio.gather(*(asyncio.create_task(mod.dp.feed_raw_update(mod.bot, u)) for u in batch))
+
+    async def queue(batch):
+        for u in batch:
+            await mod.accept_update(u)
+        while mod.update_queue.pending:
+            await asyncio.sleep(0.001)
+
+    print(f"dispatch: chats={chats} updates/chat={per_chat} api_latency={latency * 1000:.0f}ms")
+    try:
+        for n, (name, run) in enumerate((("serial", serial), ("task per update", tasks),
+                                         ("update_queue", queue))):
+            gs = [make_game(mod, chat_id=-2000 - n * chats - i, n_players=4) for i in range(chats)]
+            for g in gs:
+                mod.post_event(g, mod.EV_START)
+            for g in gs:
+                await wait_bidding(mod, g)
+            per_game = []
+            for g in gs:
+                bidders, price, ups = sorted(g.active_ids), g.price, []
+                for k in range(per_chat):
+                    uid = bidders[k % len(bidders)]
+                    if k % 5 == 4:
+                        ups.append(api.message_update(g.chat_id, uid, "/status"))
+                    else:
+                        price += 100
+                        ups.append(api.callback_update(g.chat_id, uid, g.photo_msg_id or 1, f"bid:{price}"))
+                per_game.append(ups)
+            batch = [u for row in zip(*per_game) for u in row]   # как приходят из getUpdates
+            bids = sum("callback_query" in u for u in batch)
+            accepted = 0
+            t0 = time.perf_counter()
+            await run(batch)
+            dt = time.perf_counter() - t0
+            print(f"  {name:<16} {len(batch) / dt:>7.0f} updates/s  bids accepted {accepted}/{bids}"
+                  f"  lost {bids - accepted}")
+            for g in gs:
+                mod.drop_game(g.chat_id)
+    finally:
+        mod.EVENT_HANDLERS[mod.EV_BID] = apply_bid
+
+async def bench_flood(mod, clicks: int):
+    """Один игрок долбит кнопки: ставки не выше цены, повторный пасс, кнопки закрытого
+    лота; среди спама — честные растущие ставки соседей. С антифлудом и без него:
+    сколько кликов дошло до автомата партии и сколько стоит клик."""
+    from fake_botapi import FakeBotAPI
+
+    fb = install_fake_bot(mod)
+    api = FakeBotAPI()
+    reached = Counter()
+    handlers = dict(mod.EVENT_HANDLERS)
+    for kind in (mod.EV_BID, mod.EV_PASS):
+        def counted(g, *args, _kind=kind):
+            reached[_kind] += 1
+            return handlers[_kind](g, *args)
+        mod.EVENT_HANDLERS[kind] = counted
+    middleware = mod.dp.callback_query.outer_middleware
+    flood = next(m for m in middleware if isinstance(m, mod.AntiFlood))
+
+    print(f"flood: clicks={clicks}")
+    try:
+        for n, name in enumerate(("without anti-flood", "with anti-flood")):
+            if not n:
+                middleware.unregister(flood)
+            else:
+                middleware.register(flood)
+            g = make_game(mod, chat_id=-3000 - n, n_players=8)
+            mod.post_event(g, mod.EV_START)
+            await wait_bidding(mod, g)
+            spammer, *honest, _ = g.active_ids   # последний участник молчит: лот не закроется
+            msg = g.photo_msg_id
+            reached.clear()
+            fb.calls.clear()
+            t0 = time.perf_counter()
+            for i in range(clicks):
+                if i % 100 == 99:
+                    u = api.callback_update(g.chat_id, honest[i // 100 % len(honest)], msg, f"bid:{g.price + 100}")
+                elif i % 3 == 0:
+                    u = api.callback_update(g.chat_id, spammer, msg, f"bid:{g.price}")
+                elif i % 3 == 1:
+                    u = api.callback_update(g.chat_id, spammer, msg, "pass")
+                else:
+                    u = api.callback_update(g.chat_id, spammer, msg - 1, f"bid:{g.price + 300}")
+                await mod.dp.feed_raw_update(mod.bot, u)
+            dt = time.perf_counter() - t0
+            await asyncio.sleep(mod.FLOOD_FLUSH_SEC * 2)
+            print(f"  {name:<19} {dt / clicks * 1e6:>6.0f}us/click  reached automaton: "
+                  f"bids={reached[mod.EV_BID]} passes={reached[mod.EV_PASS]}  "
+                  f"answers={fb.count('AnswerCallbackQuery') + fb.count('answer_callback_query')}  final_price={g.price}")
+            mod.drop_game(g.chat_id)
+    finally:
+        mod.EVENT_HANDLERS.update(handlers)
+        if flood not in middleware:
+            middleware.register(flood)
+
+def bench_keyboards(mod, n: int):
+    """Стоимость одной правки подписи после ставки на нашей стороне: клавиатура + подпись
+    + сборка формы запроса. Было: новая разметка и полный model_dump метода на каждый вызов."""
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.methods import EditMessageCaption
+
+    def old_keyboard(price):
+        return mod.InlineKeyboardMarkup(inline_keyboard=[
+            [mod.InlineKeyboardButton(text=f"+{s} → {price + s}", callback_data=f"bid:{price + s}")
+             for s in (100, 200, 300)],
+            [mod.InlineKeyboardButton(text="🚫 Пасс", callback_data="pass")],
+        ])
+
+    def old_caption(lot_id, price, leader, sec):
+        return f"🎨 ЛОТ №{lot_id}\n📈 Текущая ставка: {price} (от {leader})\n⏳ Осталось: {sec} сек."
+
+    prices = [1000 + 10 * (i % 300) for i in range(n)]
+    plain, tuned = AiohttpSession(), mod.AuctionSession()
+    bot = SimpleNamespace(default=mod.bot.default)
+
+    def run(keyboard, caption, session):
+        t0 = time.perf_counter()
+        for price in prices:
+            m = EditMessageCaption(chat_id=-1, message_id=7, caption=caption(3, price, "Аня", 5),
+                                   reply_markup=keyboard(price))
+            session.build_form_data(bot, m)
+        return (time.perf_counter() - t0) / n * 1e6
+
+    for price in set(prices):
+        mod.make_bid_keyboard(price)   # прогрев: в игре цены повторяются от лота к лоту
+    before = run(old_keyboard, old_caption, plain)
+    after = run(mod.make_bid_keyboard, mod.lot_bid_caption, tuned)
+    print(f"bid keyboard+caption+form: n={n}")
+    print(f"  before={before:.1f}us after={after:.1f}us per bid ({before / after:.1f}x)")
+
+# ====== СЬЮТ ОБРАБОТЧИКОВ (--suite) ======
+# Обработчики зовутся напрямую, без Dispatcher и антифлуда, на настоящих объектах aiogram,
+# привязанных к FakeBot без задержки. Объекты апдейтов строятся до замера; между замерами
+# партия возвращается в нужное состояние (лот снова на торгах, у автора снова 0 картин).
+# На каждую операцию: время (mean/p50/p99), вызовов Bot API вместе с фоновыми,
+# блоков памяти, оставшихся после операции (gc + sys.getallocatedblocks), и пик памяти
+# внутри операции по tracemalloc (отдельный прогон: tracemalloc сам тормозит).
+# Блоки бывают и отрицательными: куча таймеров чистит записи прошлых партий лениво.
+SUITE_SIZES = "2x4,10x100,100x2000"   # игроков x лотов
+ALLOC_OPS = 100                         # операций в прогоне под tracemalloc
+
+def tg_user(uid: int):
+    from aiogram import types
+    return types.User(id=uid, is_bot=False, first_name=f"p{uid}")
+
+def tg_message(fb: FakeBot, chat_id: int, uid: int, message_id: int, **fields):
+    from aiogram import types
+    return types.Message(message_id=message_id, date=int(time.time()),
+                         chat=types.Chat(id=chat_id, type="group"), from_user=tg_user(uid), **fields).as_(fb)
+
+def tg_callback(fb: FakeBot, chat_id: int, uid: int, message_id: int, data: str):
+    from aiogram import types
+    msg = types.Message(message_id=message_id, date=int(time.time()),
+                        chat=types.Chat(id=chat_id, type="group"), text="lot")
+    return types.CallbackQuery(id=f"{chat_id}:{uid}:{time.perf_counter_ns()}", from_user=tg_user(uid),
+                               chat_instance=str(chat_id), data=data, message=msg).as_(fb)
+
+def encode_strokes(w: int, h: int, q: int, strokes: list) -> str:
+    """Обратное decode_strokes: штрихи в формате рисовалки, deflate-raw + base64url."""
+    def varint(v):
+        out = bytearray()
+        while v >= 0x80:
+            out.append(v & 0x7F | 0x80)
+            v >>= 7
+        out.append(v)
+        return out
+
+    raw = varint(w) + varint(h) + varint(q)
+    for color, width, pts in strokes:
+        raw += bytes((0, *color)) + bytes((1, width)) + b"\x02" + varint(len(pts))
+        raw += varint(pts[0][0]) + varint(pts[0][1])
+        for (x0, y0), (x1, y1) in zip(pts, pts[1:]):
+            for d in (x1 - x0, y1 - y0):
+                raw += varint(d * 2 if d >= 0 else -d * 2 - 1)
+    z = zlib.compressobj(wbits=-15)
+    return base64.urlsafe_b64encode(z.compress(bytes(raw)) + z.flush()).rstrip(b"=").decode()
+
+async def drain(mod, fb: FakeBot, extra: float = 0.0):
+    """Дождаться фоновых эффектов: ответов на колбэки, загрузок, очереди outbox."""
+    await asyncio.sleep(extra)
+    seen = -1
+    while mod.effects.pending or len(fb.calls) != seen:
+        seen = len(fb.calls)
+        await asyncio.sleep(0.002)
+
+async def measure(mod, fb: FakeBot, n: int, prepare, op, settle) -> dict:
+    """n раз: prepare(i) -> аргументы (вне замера), op(*аргументы), settle() (вне замера)."""
+    times = []
+    r = op(*prepare(-1))   # прогрев: кэши и ленивые структуры первой операции не в счёт
+    if r is not None:
+        await r
+    await settle()
+    await drain(mod, fb)   # и хвосты прошлой операции тоже
+    calls0 = len(fb.calls)
+    gc.collect()
+    blocks0 = sys.getallocatedblocks()
+    for i in range(n):
+        args = prepare(i)
+        t0 = time.perf_counter()
+        r = op(*args)
+        if r is not None:
+            await r
+        times.append(time.perf_counter() - t0)
+        await settle()
+    await drain(mod, fb, mod.CAPTION_DEBOUNCE_SEC)
+    gc.collect()
+    blocks = (sys.getallocatedblocks() - blocks0) / n
+    calls = (len(fb.calls) - calls0) / n
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(min(n, ALLOC_OPS)):
+            args = prepare(n + i)
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            r = op(*args)
+            if r is not None:
+                await r
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+            await settle()
+    finally:
+        tracemalloc.stop()
+    return {"n": n, "mean": sum(times) / n * 1e6, "p50": percentile(times, 0.5) * 1e6,
+            "p99": percentile(times, 0.99) * 1e6, "api": calls, "blocks": blocks,
+            "peak": percentile(peaks, 0.5) / 1024}
+
+def refill_queue(g, lots: int):
+    """Очередь лотов не кончается: продаваемые лоты идут по второму кругу."""
+    if len(g.ledger.queue) < 2:
+        g.ledger.queue.extend(lot.id for lot in g.ledger.lots[:lots])
+
+async def bidding_game(mod, chat_id: int, players: int, lots: int):
+    g = make_game(mod, chat_id, players, lots_per_player=max(1, lots // players))
+    mod.post_event(g, mod.EV_START)
+    await wait_bidding(mod, g)
+    return g
+
+async def suite_size(mod, fb: FakeBot, players: int, lots: int, iters: int, base: int) -> list:
+    """Все операции на партии players x lots; [(операция, результат measure)]."""
+    from aiogram import types
+
+    rows = []
+
+    async def back_to_bidding(g):
+        refill_queue(g, lots)
+        await wait_bidding(mod, g)
+
+    # ставки растут, игроки по кругу
+    g = await bidding_game(mod, base - 1, players, lots)
+
+    def bid(i):
+        uid = g.active_ids[i % len(g.active_ids)]
+        return (tg_callback(fb, g.chat_id, uid, g.photo_msg_id, f"bid:{g.price + 100}"),)
+    rows.append(("on_bid", await measure(mod, fb, iters, bid, mod.on_bid, lambda: back_to_bidding(g))))
+    mod.drop_game(g.chat_id)
+
+    # пасс, который лот не закрывает (кроме партии на двоих: там он последний)
+    g = await bidding_game(mod, base - 2, players, lots)
+
+    def pass_(i):
+        g.passed.clear()
+        return (tg_callback(fb, g.chat_id, g.active_ids[i % len(g.active_ids)], g.photo_msg_id, "pass"),)
+    rows.append(("on_pass", await measure(mod, fb, iters, pass_, mod.on_pass, lambda: back_to_bidding(g))))
+
+    # смена лота: прошлый закрыт вне замера, меряем открытие следующего
+    def close_lot(i):
+        mod.cleanup_after_lot(g)
+        return (g,)
+    rows.append(("next_lot", await measure(mod, fb, iters, close_lot, mod.next_lot, lambda: back_to_bidding(g))))
+
+    # продажа лидеру вместе с открытием следующего лота
+    def lead(i):
+        g.leader = g.active_ids[i % len(g.active_ids)]
+        g.price += 100
+        return (g, "⏰ Время вышло")
+    rows.append(("finalize_sale", await measure(mod, fb, iters, lead, mod.finalize_sale,
+                                                lambda: back_to_bidding(g))))
+    mod.drop_game(g.chat_id)
+
+    # до аукциона: автор добавляет картину, остальные ещё нет — аукцион не стартует
+    g = make_game(mod, base - 3, players, lots_per_player=max(1, lots // players))
+    author = g.players[1]
+
+    async def lobby_settle():
+        while author.arts_pending:
+            await asyncio.sleep(0.001)
+        author.arts_created = 0
+
+    def photo(i):
+        return (tg_message(fb, g.chat_id, author.id, 10 + i, photo=[
+            types.PhotoSize(file_id=f"upl{i}", file_unique_id=f"u{i}", width=800, height=500)]),)
+    rows.append(("on_photo", await measure(mod, fb, iters, photo, mod.on_photo, lobby_settle)))
+
+    strokes = encode_strokes(100, 60, 4, [((255, 200, 0), 6, [(10 + k, 10 + k // 2) for k in range(40)]),
+                                           ((0, 120, 255), 3, [(80 - k, 50 - k // 3) for k in range(60)])])
+    payload = json.dumps({"title": "Закат", "strokes": strokes, "z": 1})
+
+    def drawing(i):
+        return (tg_message(fb, g.chat_id, author.id, 10 + i,
+                           web_app_data=types.WebAppData(data=payload, button_text="🎨 Рисовать")),)
+    rows.append(("on_web_app_data", await measure(mod, fb, iters, drawing, mod.on_web_app_data, lobby_settle)))
+    mod.drop_game(g.chat_id)
+
+    # итоги: все лоты разошлись, половина продана
+    g = make_game(mod, base - 4, players, lots_per_player=max(1, lots // players))
+    for k, lot in enumerate(g.ledger.lots):
+        buyer = 1 + (lot.author_id + k) % players
+        if k % 2 and buyer != lot.author_id:
+            g.ledger.settle(lot, g.players[buyer], buyer, lot.start_price)
+        else:
+            g.ledger.settle(lot, None, lot.author_id)
+
+    async def results_settle():
+        await drain(mod, fb)
+    rows.append(("show_results", await measure(mod, fb, max(3, iters // 20), lambda i: (g,), mod.show_results,
+                                               results_settle)))
+    mod.drop_game(g.chat_id)
+    return rows
+
+async def run_suite(mod, sizes: str, iters: int, out: str, max_bid_us: float | None) -> int:
+    import aiogram
+    fb = install_fake_bot(mod)
+    random.seed(1)
+    lines = [f"handler suite  {time.strftime('%Y-%m-%d %H:%M')}  python {platform.python_version()}  "
+             f"aiogram {aiogram.__version__}  iters={iters}",
+             f"{'size':>8} {'op':<16} {'n':>5} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} "
+             f"{'api/op':>7} {'blocks/op':>10} {'peak KiB':>9}"]
+    print("\n".join(lines))
+    slow = []
+    for k, size in enumerate(sizes.split(",")):
+        players, lots = (int(x) for x in size.split("x"))
+        for op, r in await suite_size(mod, fb, players, lots, iters, base=-5000 - 10 * k):
+            line = (f"{size:>8} {op:<16} {r['n']:>5} {r['mean']:>9.1f} {r['p50']:>9.1f} {r['p99']:>9.1f} "
+                    f"{r['api']:>7.2f} {r['blocks']:>10.1f} {r['peak']:>9.1f}")
+            print(line)
+            lines.append(line)
+            if op == "on_bid" and max_bid_us is not None and r["p50"] > max_bid_us:
+                slow.append(f"on_bid p50 {r['p50']:.1f}us > {max_bid_us:.1f}us at {size}")
+    lines.extend(f"REGRESSION {s}" for s in slow)
+    for s in slow:
+        print(f"REGRESSION {s}")
+    with open(out, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    print(f"written to {out}")
+    return 1 if slow else 0
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--players", type=int, default=12)
+    ap.add_argument("--waves", type=int, default=20)
+    ap.add_argument("--kb-iters", type=int, default=20000, help="итераций микробенчмарка клавиатур")
+    ap.add_argument("--chats", type=int, default=50, help="чатов в бенчмарке диспетчеризации")
+    ap.add_argument("--per-chat", type=int, default=20, help="апдейтов на чат в бенчмарке диспетчеризации")
+    ap.add_argument("--flood-clicks", type=int, default=3000, help="кликов в бенчмарке антифлуда")
+    ap.add_argument("--latency", type=float, default=0.05, help="искусственная задержка Bot API, сек")
+    ap.add_argument("--telegram-limits", action="store_true",
+                    help="оставить лимиты outbox как для настоящего Telegram (иначе меряем только свой код)")
+    ap.add_argument("--suite", action="store_true", help="вместо остального: сьют обработчиков")
+    ap.add_argument("--sizes", default=SUITE_SIZES, help="партии сьюта: игроков x лотов через запятую")
+    ap.add_argument("--iters", type=int, default=500, help="операций на обработчик в сьюте")
+    ap.add_argument("--out", default="bench_output.txt", help="куда записать таблицу сьюта")
+    ap.add_argument("--max-bid-us", type=float, help="p50 on_bid выше — код выхода 1")
+    ap.add_argument("--journals", action="store_true",
+                    help="вести журнал и журнал событий (во временный каталог), как в бою")
+    args = ap.parse_args()
+
+    if args.journals:
+        os.environ["JOURNAL_DIR"] = tempfile.mkdtemp(prefix="auction-bench-")
+    mod = load_bot()
+    mod.log.setLevel("WARNING")
+    logging.getLogger("aiogram.event").setLevel("WARNING")   # строка на каждый апдейт
+    if not args.telegram_limits:
+        mod.OUT_CHAT_RATE = mod.OUT_CHAT_BURST = 10 ** 6
+        mod.outbox.bucket = mod.TokenBucket(10 ** 6, 10 ** 6)
+
+    if args.suite:
+        if args.journals:
+            mod.journal.start()
+            mod.event_log.start()
+        try:
+            code = asyncio.run(run_suite(mod, args.sizes, args.iters, args.out, args.max_bid_us))
+        finally:
+            mod.event_log.close()
+            mod.journal.close()
+        sys.exit(code)
+
+    bench_keyboards(mod, args.kb_iters)
+
+    async def run_all():
+        # один цикл событий на всё: outbox и планировщик живут в нём
+        await bench_bid_burst(mod, args.players, args.waves, args.latency)
+        await bench_lot_transitions(mod, args.players, args.latency, args.telegram_limits)
+        await bench_dispatch(mod, args.chats, args.per_chat, args.latency)
+        await bench_flood(mod, args.flood_clicks)
+
+    asyncio.run(run_all())
+
+if __name__ == "__main__":
+    main()
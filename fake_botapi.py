@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная заглушка Telegram Bot API на aiohttp — для прогонов без сети.
+
+Бот направляется на неё через BOT_API_URL (aiogram TelegramAPIServer).
+Заглушка отвечает на методы, которыми пользуется бот, отдаёт апдейты
+через getUpdates или сама POST-ит их на вебхук, если бот его установил.
+
+Сравнить polling и webhook по апдейтам в секунду:
+  python fake_botapi.py --mode polling --updates 3000
+  python fake_botapi.py --mode webhook --updates 3000
+
+Сравнить сессии Bot API (AiohttpSession и AuctionSession бота) по вызовам в секунду:
+  python fake_botapi.py --api-bench 6000
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+
+from aiohttp import ClientSession, web
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "What is your name.py")
+FAKE_TOKEN = "424242:fake-token"
+
+BOT_USER = {"id": 424242, "is_bot": True, "first_name": "Auction", "username": "fake_auction_bot"}
+
+def user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"p{uid}"}
+
+def chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "group", "title": f"load {chat_id}"}
+
+class FakeBotAPI:
+    """Состояние заглушки: очередь апдейтов, вебхук, счётчики вызовов."""
+
+    def __init__(self):
+        self.updates: deque = deque()
+        self._has_updates = asyncio.Event()
+        self._update_id = itertools.count(1)
+        self._message_id = itertools.count(1)
+        self._file_id = itertools.count(1)
+        self.webhook_url: str | None = None
+        self.webhook_secret: str | None = None
+        self.webhook_set = asyncio.Event()
+        self.polled = asyncio.Event()
+        self.calls: Counter = Counter()
+        self.listeners: list = []      # callback(method, params, result) на каждый вызов
+
+    # --- апдейты ---
+    def message_update(self, chat_id: int, uid: int, text: str) -> dict:
+        msg = {"message_id": next(self._message_id), "date": int(time.time()),
+               "chat": chat(chat_id), "from": user(uid), "text": text}
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_id), "message": msg}
+
+    def photo_update(self, chat_id: int, uid: int) -> dict:
+        n = next(self._file_id)
+        msg = {"message_id": next(self._message_id), "date": int(time.time()),
+               "chat": chat(chat_id), "from": user(uid),
+               "photo": [{"file_id": f"upl{n}", "file_unique_id": f"u{n}", "width": 800, "height": 500}]}
+        return {"update_id": next(self._update_id), "message": msg}
+
+    def callback_update(self, chat_id: int, uid: int, message_id: int, data: str) -> dict:
+        cq = {"id": str(next(self._update_id)), "from": user(uid), "chat_instance": str(chat_id),
+              "data": data,
+              "message": {"message_id": message_id, "date": int(time.time()), "chat": chat(chat_id),
+                          "from": BOT_USER, "text": "lot"}}
+        return {"update_id": next(self._update_id), "callback_query": cq}
+
+    def push(self, update: dict):
+        self.updates.append(update)
+        self._has_updates.set()
+
+    # --- Bot API ---
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        handler = getattr(self, "m_" + method.lower(), None)
+        result = await handler(params) if handler else self._message(params)
+        for cb in self.listeners:
+            cb(method, params, result)
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    async def _params(request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        form = await request.post()
+        params = {}
+        for k, v in form.items():
+            if isinstance(v, str):
+                try:
+                    params[k] = json.loads(v)
+                except ValueError:
+                    params[k] = v
+            else:
+                params[k] = v   # файл
+        return params
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        msg = {"message_id": int(params.get("message_id") or next(self._message_id)),
+               "date": int(time.time()), "chat": chat(chat_id), "from": BOT_USER}
+        if "caption" in params or "photo" in params:
+            n = next(self._file_id)
+            msg["photo"] = [{"file_id": f"ph{n}", "file_unique_id": f"q{n}", "width": 800, "height": 500}]
+            if params.get("caption"):
+                msg["caption"] = str(params["caption"])
+        else:
+            msg["text"] = str(params.get("text") or "")
+        return msg
+
+    async def m_getme(self, params):
+        return BOT_USER
+
+    async def m_setwebhook(self, params):
+        self.webhook_url = params.get("url")
+        self.webhook_secret = params.get("secret_token")
+        self.webhook_set.set()
+        return True
+
+    async def m_deletewebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    async def m_getupdates(self, params):
+        self.polled.set()
+        offset = int(params.get("offset") or 0)
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates:
+            self._has_updates.clear()
+            timeout = float(params.get("timeout") or 0)
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit") or 100)
+        return list(itertools.islice(self.updates, limit))
+
+    async def m_answercallbackquery(self, params):
+        return True
+
+    async def m_deletemessage(self, params):
+        return True
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+    async def deliver_webhook(self, updates, concurrency: int = 64):
+        """POST-ит апдейты на вебхук бота, держа не больше concurrency запросов в полёте."""
+        sem = asyncio.Semaphore(concurrency)
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret or ""}
+        async with ClientSession() as http:
+            async def post(u):
+                async with sem:
+                    async with http.post(self.webhook_url, json=u, headers=headers) as r:
+                        await r.read()
+            await asyncio.gather(*(post(u) for u in updates))
+
+async def start_fake(api: FakeBotAPI, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+def spawn_bot(api_url: str, mode: str, web_port: int, extra_env: dict | None = None) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "API_TOKEN": FAKE_TOKEN,
+        "BOT_API_URL": api_url,
+        "BOT_MODE": mode,
+        "WEB_HOST": "127.0.0.1",
+        "WEB_PORT": str(web_port),
+        "WEBHOOK_URL": f"http://127.0.0.1:{web_port}",
+        "DRAW_WEBAPP_URL": "https://example.invalid/draw",
+        "JOURNAL_DIR": tempfile.mkdtemp(prefix="auction-journal-"),
+        "LOG_LEVEL": "WARNING",
+    })
+    env.update(extra_env or {})
+    return subprocess.Popen([sys.executable, BOT_FILE], env=env)
+
+async def compare(mode: str, n_updates: int, chats: int, port: int, web_port: int):
+    api = FakeBotAPI()
+    runner = await start_fake(api, port=port)
+    # ответы на /join идут через outbox: лимиты Telegram сняты, иначе меряли бы их, а не приём
+    proc = spawn_bot(f"http://127.0.0.1:{port}", mode, web_port,
+                     {"OUT_GLOBAL_RATE": "1000000", "OUT_CHAT_RATE": "1000000", "OUT_CHAT_BURST": "1000000"})
+    try:
+        ready = api.webhook_set if mode == "webhook" else api.polled
+        await asyncio.wait_for(ready.wait(), 60)
+
+        replies = asyncio.Event()
+        got = 0
+
+        def on_call(method, params, result):
+            nonlocal got
+            if method == "sendMessage":
+                got += 1
+                if got >= n_updates:
+                    replies.set()
+        api.listeners.append(on_call)
+
+        updates = [api.message_update(-100 - i % chats, 1 + i % 50, "/join") for i in range(n_updates)]
+        t0 = time.perf_counter()
+        if mode == "webhook":
+            await api.deliver_webhook(updates)
+        else:
+            for u in updates:
+                api.push(u)
+        await asyncio.wait_for(replies.wait(), 120)
+        dt = time.perf_counter() - t0
+        print(f"{mode}: {n_updates} updates in {dt:.2f}s -> {n_updates / dt:.0f} updates/s "
+              f"(api calls: {dict(api.calls)})")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        await runner.cleanup()
+
+async def api_bench(n_calls: int, concurrency: int, port: int):
+    """Смесь горячих вызовов игры (ответ на колбэк, правка подписи, сообщение) через обе сессии."""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from bench import load_bot
+
+    mod = load_bot()
+    logging.getLogger("aiohttp.access").setLevel(logging.WARNING)   # лог заглушки съел бы всю разницу
+    api = FakeBotAPI()
+    runner = await start_fake(api, port=port)
+    server = TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")
+    markup = mod.make_bid_keyboard(500)
+    try:
+        for name, session in (("AiohttpSession", AiohttpSession(api=server)),
+                              ("AuctionSession", mod.AuctionSession(api=server))):
+            b = Bot(FAKE_TOKEN, session=session)
+            sem = asyncio.Semaphore(concurrency)
+
+            async def one(i):
+                async with sem:
+                    if i % 3 == 0:
+                        await b.answer_callback_query(str(i), text="Ставка принята ✅")
+                    elif i % 3 == 1:
+                        await b.edit_message_caption(chat_id=-1, message_id=7, reply_markup=markup,
+                                                     caption=mod.lot_bid_caption(1, 500 + i, "Аня", 5))
+                    else:
+                        await b.send_message(-1, "🔔 сообщение")
+
+            await asyncio.gather(*(one(i) for i in range(300)))   # прогрев пула соединений
+            t0, c0 = time.perf_counter(), time.process_time()
+            await asyncio.gather(*(one(i) for i in range(n_calls)))
+            dt, cpu = time.perf_counter() - t0, time.process_time() - c0
+            print(f"{name}: {n_calls} calls in {dt:.2f}s -> {n_calls / dt:.0f} calls/s "
+                  f"({cpu / n_calls * 1e6:.0f}us CPU per call incl. the stand-in)")
+            await session.close()
+    finally:
+        await runner.cleanup()
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--mode", choices=("polling", "webhook", "both"), default="both")
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--chats", type=int, default=20)
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--web-port", type=int, default=8090)
+    ap.add_argument("--api-bench", type=int, metavar="N", help="вместо сравнения режимов: N вызовов через обе сессии")
+    ap.add_argument("--concurrency", type=int, default=64)
+    args = ap.parse_args()
+    if args.api_bench:
+        asyncio.run(api_bench(args.api_bench, args.concurrency, args.port))
+        return
+    modes = ("polling", "webhook") if args.mode == "both" else (args.mode,)
+    for mode in modes:
+        asyncio.run(compare(mode, args.updates, args.chats, args.port, args.web_port))
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import asyncio
+import importlib.util
+import os
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 import dotenv
@@ -6,13 +8,27 @@ import dotenv
 # --- НАСТРОЙКИ ---
 # Бесплатный публичный HTTPS-прокси (для теста)
 # ⚠️ такие прокси иногда "умирают", тогда надо будет заменить на другой
-
-bot = Bot(token=TOKEN, proxy=PROXY_URL)
-dp = Dispatcher()
-
 TOKEN = dotenv.get_key(".env", "TOKEN")
 PROXY_URL = dotenv.get_key(".env", "PROXY_URL")
 
+def auction_session():
+    """Сессия бота (AuctionSession из «What is your name.py»): прокси проверяем ровно на том,
+    чем ходит бот. Файл бота грузим через importlib — в имени пробелы; он читает те же
+    настройки из окружения, поэтому передаём их туда."""
+    os.environ.setdefault("API_TOKEN", TOKEN or "")
+    if PROXY_URL:
+        os.environ.setdefault("PROXY_URL", PROXY_URL)
+    os.environ.setdefault("SESSION_POOL_LIMIT", "20")   # прокси один — пул небольшой
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "What is your name.py")
+    spec = importlib.util.spec_from_file_location("auction_bot", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod.AuctionSession()
+
+# в aiogram 3 прокси задаётся у сессии
+bot = Bot(token=TOKEN, session=auction_session())
+dp = Dispatcher()
+
 @dp.message(Command("start"))
 async def start(message: types.Message):
     await message.answer("Бот запустился через прокси ✅")
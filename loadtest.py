@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Сквозной нагрузочный прогон бота без сети.
+
+Поднимает заглушку Bot API (fake_botapi.py), запускает настоящий бот
+отдельным процессом (polling на заглушку) и гоняет рой синтетических
+игроков: /join, по 2 фото, ставки и пассы на каждом лоте. Считает:
+  - задержку ответа на ставку (update -> answerCallbackQuery), p50/p99;
+  - время смены лота (подпись продажи -> фото следующего лота);
+  - вызовов Bot API на лот;
+  - сколько одновременных партий выдерживает один процесс (= одно ядро),
+    пока p99 ставки не превысит порог.
+
+  python loadtest.py                           # ступени 1,2,4,8,16 партий
+  python loadtest.py --stages 1,8,32 --players 6
+  python loadtest.py --stages 8 --max-p99-ms 150   # как регрессионный гейт (код выхода 1)
+  python loadtest.py --shards 4 --stages 16,32,64  # фронт + 4 процесса-воркера
+"""
+
+import argparse
+import asyncio
+import random
+import re
+import sys
+import time
+
+from fake_botapi import FakeBotAPI, spawn_bot, start_fake
+
+PRICE_RE = re.compile(r"(?:Стартовая цена|Текущая ставка): (\d+)")
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class Stats:
+    def __init__(self):
+        self.ack_ms: list = []
+        self.transition_ms: list = []
+        self.lots = 0
+        self.games_done = 0
+
+class GameSwarm:
+    """Игроки одного чата. События бота приходят в inbox из слушателя заглушки."""
+
+    def __init__(self, api: FakeBotAPI, chat_id: int, players: int, rounds: int, stats: Stats,
+                 sent_at: dict, rng: random.Random):
+        self.api = api
+        self.chat_id = chat_id
+        self.uids = [chat_id * -1000 + i for i in range(1, players + 1)]
+        self.rounds = rounds
+        self.stats = stats
+        self.sent_at = sent_at
+        self.rng = rng
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.closed_at: float | None = None
+
+    def push_callback(self, uid: int, message_id: int, data: str):
+        upd = self.api.callback_update(self.chat_id, uid, message_id, data)
+        self.sent_at[str(upd["callback_query"]["id"])] = time.perf_counter()
+        self.api.push(upd)
+
+    async def run(self):
+        for uid in self.uids:
+            self.api.push(self.api.message_update(self.chat_id, uid, "/join"))
+        for _ in range(2):
+            for uid in self.uids:
+                self.api.push(self.api.photo_update(self.chat_id, uid))
+        while True:
+            kind, *args = await self.inbox.get()
+            if kind == "results":
+                self.stats.games_done += 1
+                return
+            if kind != "lot":
+                continue
+            message_id, price, t = args
+            if self.closed_at is not None:
+                self.stats.transition_ms.append((t - self.closed_at) * 1000)
+            await self.play_lot(message_id, price)
+
+    async def play_lot(self, message_id: int, price: int):
+        for _ in range(self.rounds):
+            for uid in self.rng.sample(self.uids, len(self.uids)):
+                price += 100 * self.rng.choice((1, 2, 3))
+                self.push_callback(uid, message_id, f"bid:{price}")
+                await asyncio.sleep(self.rng.uniform(0.01, 0.05))
+        for uid in self.uids:
+            self.push_callback(uid, message_id, "pass")
+        # ждём закрытия лота (или финала — вдруг это был последний)
+        while True:
+            kind, *args = await self.inbox.get()
+            if kind == "closed":
+                self.closed_at = args[0]
+                self.stats.lots += 1
+                return
+            if kind == "results":
+                self.inbox.put_nowait((kind, *args))
+                return
+
+def route_calls(api: FakeBotAPI, swarms: dict, stats: Stats, sent_at: dict):
+    """Раскладывает вызовы Bot API бота по роям чатов."""
+    def on_call(method, params, result):
+        now = time.perf_counter()
+        if method == "answerCallbackQuery":
+            t0 = sent_at.pop(str(params.get("callback_query_id")), None)
+            if t0 is not None:
+                stats.ack_ms.append((now - t0) * 1000)
+            return
+        swarm = swarms.get(int(params.get("chat_id") or 0))
+        if swarm is None:
+            return
+        caption = str(params.get("caption") or "")
+        if method == "sendPhoto" and params.get("reply_markup"):
+            m = PRICE_RE.search(caption)
+            swarm.inbox.put_nowait(("lot", result["message_id"], int(m.group(1)) if m else 0, now))
+        elif method == "editMessageCaption" and not params.get("reply_markup"):
+            swarm.inbox.put_nowait(("closed", now))
+        elif method == "sendMessage" and "Аукцион завершён" in str(params.get("text") or ""):
+            swarm.inbox.put_nowait(("results",))
+    return on_call
+
+async def run_stage(api: FakeBotAPI, n_games: int, players: int, rounds: int, chat_base: int, seed: int):
+    stats = Stats()
+    sent_at: dict = {}
+    rng = random.Random(seed)
+    swarms = {chat_base - i: GameSwarm(api, chat_base - i, players, rounds, stats, sent_at, rng)
+              for i in range(n_games)}
+    listener = route_calls(api, swarms, stats, sent_at)
+    api.listeners.append(listener)
+    calls_before = sum(api.calls.values())
+    t0 = time.perf_counter()
+    try:
+        await asyncio.gather(*(s.run() for s in swarms.values()))
+    finally:
+        api.listeners.remove(listener)
+    dt = time.perf_counter() - t0
+    calls = sum(api.calls.values()) - calls_before
+    return stats, dt, calls
+
+async def main_async(args) -> int:
+    api = FakeBotAPI()
+    runner = await start_fake(api, port=args.port)
+    proc = spawn_bot(f"http://127.0.0.1:{args.port}", "polling", args.web_port,
+                     {"BID_TIMER_SEC": str(args.timer), "SHARDS": str(args.shards)})
+    worst = 0.0
+    capacity = 0
+    degraded_at = None
+    try:
+        await asyncio.wait_for(api.polled.wait(), 60)
+        print(f"{'games':>6} {'lots':>6} {'ack p50':>9} {'ack p99':>9} {'lot switch p50':>15} "
+              f"{'calls/lot':>10} {'time':>7}")
+        for i, n_games in enumerate(args.stages):
+            stats, dt, calls = await asyncio.wait_for(
+                run_stage(api, n_games, args.players, args.rounds, -10 ** 9 - i * 10 ** 5, args.seed),
+                args.stage_timeout)
+            p50, p99 = percentile(stats.ack_ms, 0.5), percentile(stats.ack_ms, 0.99)
+            print(f"{n_games:>6} {stats.lots:>6} {p50:>7.1f}ms {p99:>7.1f}ms "
+                  f"{percentile(stats.transition_ms, 0.5):>13.0f}ms "
+                  f"{calls / max(stats.lots, 1):>10.1f} {dt:>6.1f}s")
+            worst = max(worst, p99)
+            if p99 <= args.max_p99_ms:
+                capacity = n_games
+            else:
+                degraded_at = n_games
+                break
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        await runner.cleanup()
+    unit = "core" if args.shards == 1 else f"{args.shards} shards"
+    print(f"games per {unit} with bid-ack p99 <= {args.max_p99_ms:.0f}ms: {capacity}"
+          + (f" (degraded at {degraded_at} games)" if degraded_at else ""))
+    return 0 if worst <= args.max_p99_ms else 1
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--stages", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4, 8, 16],
+                    help="сколько одновременных партий на каждой ступени")
+    ap.add_argument("--players", type=int, default=4)
+    ap.add_argument("--rounds", type=int, default=2, help="кругов ставок на лот перед пассами")
+    ap.add_argument("--timer", type=int, default=10, help="BID_TIMER_SEC бота")
+    ap.add_argument("--shards", type=int, default=1, help="процессов-воркеров бота (SHARDS)")
+    ap.add_argument("--max-p99-ms", type=float, default=200.0)
+    ap.add_argument("--stage-timeout", type=float, default=600.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--web-port", type=int, default=8090)
+    args = ap.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+if __name__ == "__main__":
+    main()
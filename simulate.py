@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Офлайн-симулятор аукциона для балансировки экономики.
+
+Играет партии по тем же правилам, что и бот (auction_rules.py), но без Telegram:
+за игроков ставят стратегии, лот закрывается, когда пасс решил его судьбу или круг
+прошёл без ставок (у бота в этот момент истёк бы таймер). Партии раскладываются по
+процессам. Печатает долю побед и средний капитал стратегий и распределение цен продаж.
+
+  python simulate.py                                    # 20000 партий по 4 игрока
+  python simulate.py --games 100000 --players 6 --strategies value,greedy,random,value+loan
+  python simulate.py --strategies value,mybots:shark    # своя стратегия: модуль:функция
+
+Стратегия — функция (t, p, rng) -> цена ставки или None (пасс). t — торги (lot,
+active_ids, price, leader, passed), p — свой Player. Смотреть lot.real_value нельзя:
+игроки в боте её не знают. Атрибут loan = True — игрок берёт кредит в начале партии.
+"""
+
+import argparse
+import importlib
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from auction_rules import (
+    BID_OK, BID_STEPS, MAX_ARTS_PER_PLAYER, PASS_KEPT, PASS_SOLD, START_OFFSETS,
+    Ledger, Lot, Player, deadline_outcome, open_lot, place_bid, place_pass, price_lot, take_loan,
+)
+
+MAX_ROUNDS = 100   # предохранитель от стратегий, которые перебивают друг друга вечно
+
+class Bidding:
+    """Торги одного лота — те же поля, что у партии бота."""
+    __slots__ = ("lot", "active_ids", "price", "leader", "passed")
+
+    def __init__(self):
+        self.lot: Lot | None = None
+        self.active_ids: list = []
+        self.price = 0
+        self.leader: int | None = None
+        self.passed: set = set()
+
+# ====== СТРАТЕГИИ ======
+EXPECTED_OFFSET = sum(START_OFFSETS) // len(START_OFFSETS)   # реальная ≈ старт + это
+
+def passive(t, p, rng):
+    return None
+
+def random_bidder(t, p, rng):
+    if t.leader == p.id or rng.random() < 0.5:
+        return None
+    price = t.price + rng.choice(BID_STEPS)
+    return price if price <= p.money else None
+
+def value_bidder(t, p, rng):
+    """Минимальный шаг, пока цена не выше ожидаемой реальной стоимости."""
+    price = t.price + BID_STEPS[0]
+    if t.leader == p.id or price > t.lot.start_price + EXPECTED_OFFSET or price > p.money:
+        return None
+    return price
+
+def greedy_bidder(t, p, rng):
+    """Переплачивает до +50% к ожидаемой стоимости — лишь бы забрать лот."""
+    price = t.price + BID_STEPS[0]
+    if t.leader == p.id or price > (t.lot.start_price + EXPECTED_OFFSET) * 3 // 2 or price > p.money:
+        return None
+    return price
+
+def with_loan(strategy):
+    def loaned(t, p, rng):
+        return strategy(t, p, rng)
+    loaned.loan = True
+    return loaned
+
+STRATEGIES = {
+    "passive": passive,
+    "random": random_bidder,
+    "value": value_bidder,
+    "greedy": greedy_bidder,
+    "value+loan": with_loan(value_bidder),
+    "greedy+loan": with_loan(greedy_bidder),
+}
+
+def resolve(name: str):
+    """Стратегия по имени из STRATEGIES или «модуль:функция»."""
+    if name in STRATEGIES:
+        return STRATEGIES[name]
+    module, _, func = name.partition(":")
+    if not func:
+        raise SystemExit(f"unknown strategy {name!r}: one of {', '.join(STRATEGIES)} or module:function")
+    return getattr(importlib.import_module(module), func)
+
+# ====== ПАРТИЯ ======
+def play_lot(t: Bidding, players: dict, strategies: dict, rng: random.Random) -> int:
+    """Круги ставок по лоту; PASS_SOLD или PASS_KEPT."""
+    for _ in range(MAX_ROUNDS):
+        order = list(t.active_ids)
+        rng.shuffle(order)
+        bids = 0
+        for uid in order:
+            want = strategies[uid](t, players[uid], rng)
+            if want is None:
+                outcome = place_pass(t, uid)
+                if outcome in (PASS_SOLD, PASS_KEPT):
+                    return outcome
+            elif place_bid(t, players, uid, want) == BID_OK:
+                bids += 1
+        if not bids:
+            break
+    return deadline_outcome(t)
+
+def play_game(seats: list, rng: random.Random, stats: dict):
+    """Одна партия; seats — имена стратегий по местам. Итоги копятся в stats."""
+    players, strategies, ledger = {}, {}, Ledger()
+    for uid, name in enumerate(seats, 1):
+        p = players[uid] = Player(uid, name, None)
+        strategies[uid] = s = resolve(name)
+        if getattr(s, "loan", False):
+            take_loan(p)
+        for _ in range(MAX_ARTS_PER_PLAYER):
+            real, start = price_lot(rng)
+            lot_id = ledger.next_id()
+            ledger.add(Lot(lot_id, uid, f"Картина #{lot_id}", "", real, start))
+            p.arts_created += 1
+    ledger.shuffle_queue(rng)
+
+    t = Bidding()
+    while (lot := ledger.pop_next()) is not None:
+        if not open_lot(t, lot, players):
+            ledger.settle(lot, None, lot.author_id)
+            stats["kept"] += 1
+            continue
+        if play_lot(t, players, strategies, rng) == PASS_SOLD:
+            ledger.settle(lot, players[t.leader], t.leader, t.price)
+            stats["prices"][t.price] += 1
+            stats["ratios"][round(t.price / lot.real_value, 1)] += 1
+        else:
+            ledger.settle(lot, None, lot.author_id)
+            stats["kept"] += 1
+
+    rating = ledger.ranking(players.values())
+    top = [p for cap, p, _ in rating if cap == rating[0][0]]
+    for cap, p, _ in rating:
+        stats["seats"][p.name] += 1
+        stats["capital"][p.name] += cap
+    for p in top:
+        stats["wins"][p.name] += 1 / len(top)   # ничью делим
+
+def run_chunk(names: list, n_players: int, first_game: int, n_games: int, seed: int) -> dict:
+    """Пачка партий в одном процессе. Стратегии по местам сдвигаются от партии к партии,
+    чтобы каждая встречала всех соперников на всех местах."""
+    rng = random.Random(seed)
+    stats = {"wins": Counter(), "seats": Counter(), "capital": Counter(),
+             "prices": Counter(), "ratios": Counter(), "kept": 0}
+    for g in range(first_game, first_game + n_games):
+        seats = [names[(g + i) % len(names)] for i in range(n_players)]
+        play_game(seats, rng, stats)
+    return stats
+
+def merge(into: dict, part: dict):
+    for key, value in part.items():
+        if isinstance(value, Counter):
+            into.setdefault(key, Counter()).update(value)
+        else:
+            into[key] = into.get(key, 0) + value
+
+def counter_percentile(c: Counter, q: float) -> int:
+    total, seen = sum(c.values()), 0
+    for value in sorted(c):
+        seen += c[value]
+        if seen >= q * total:
+            return value
+    return 0
+
+def report(stats: dict, names: list):
+    print(f"{'strategy':<14} {'seats':>8} {'win rate':>9} {'avg capital':>12}")
+    for name in names:
+        seats = stats["seats"][name]
+        if not seats:
+            continue
+        print(f"{name:<14} {seats:>8} {stats['wins'][name] / seats:>8.1%} "
+              f"{stats['capital'][name] / seats:>12.0f}")
+    sold = sum(stats["prices"].values())
+    lots = sold + stats["kept"]
+    print(f"lots: {lots}  sold {sold / max(lots, 1):.1%}  kept by author {stats['kept'] / max(lots, 1):.1%}")
+    if not sold:
+        return
+    prices = stats["prices"]
+    print("sale price: " + "  ".join(f"p{int(q * 100)}={counter_percentile(prices, q)}"
+                                    for q in (0.1, 0.5, 0.9, 0.99)))
+    print("sale price / real value:")
+    for ratio in sorted(stats["ratios"]):
+        share = stats["ratios"][ratio] / sold
+        if share >= 0.001:
+            print(f"  {ratio:>4.1f} {'#' * round(share * 60):<60} {share:>6.1%}")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--games", type=int, default=20000)
+    ap.add_argument("--players", type=int, default=4)
+    ap.add_argument("--strategies", default="value,greedy,random,passive",
+                    help="через запятую: " + ", ".join(STRATEGIES) + " или модуль:функция")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов (1 — без пула)")
+    ap.add_argument("--chunk", type=int, default=2000, help="партий на задачу процесса")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    names = args.strategies.split(",")
+    for name in names:
+        resolve(name)   # опечатку ловим до запуска пула
+    chunks = [(names, args.players, first, min(args.chunk, args.games - first), args.seed + first)
+              for first in range(0, args.games, args.chunk)]
+    stats: dict = {}
+    t0 = time.perf_counter()
+    if args.workers == 1:
+        for chunk in chunks:
+            merge(stats, run_chunk(*chunk))
+    else:
+        with ProcessPoolExecutor(args.workers) as pool:
+            for part in pool.map(run_chunk, *zip(*chunks)):
+                merge(stats, part)
+    dt = time.perf_counter() - t0
+    print(f"{args.games} games x {args.players} players in {dt:.2f}s -> {args.games / dt:.0f} games/s "
+          f"({args.workers} worker{'s' if args.workers != 1 else ''})")
+    report(stats, names)
+
+if __name__ == "__main__":
+    main()